@@ -0,0 +1,72 @@
+"""
+Lines/sec and p99 emit latency of RotatingFileHandler vs JSONLinesFileHandler
+
+    PYTHONPATH=. python benchmarks/bench_log_file_sink.py
+"""
+import logging
+import os
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler
+
+from fastapi_app.core.log_file_sink import SEGMENT_COMPRESSOR, JSONLinesFileHandler
+from fastapi_app.core.logging_formatter import FastJSONLogFormatter
+
+NUMBER = 50_000
+MAX_BYTES = 10 * 1024 * 1024
+
+
+def make_record(index: int) -> logging.LogRecord:
+    record = logging.LogRecord(
+        "main",
+        logging.INFO,
+        __file__,
+        1,
+        f'127.0.0.1:59354 - "GET    http://localhost:8000/items/{index} HTTP/1.1"'
+        ' 200 "OK" 3ms',
+        None,
+        None,
+    )
+    record.request_json_fields = {
+        "request_uri": f"http://localhost:8000/items/{index}",
+        "request_method": "GET",
+        "request_path": f"/items/{index}",
+        "response_status_code": 200,
+        "duration": 3,
+    }
+    return record
+
+
+def run(handler: logging.Handler) -> tuple:
+    handler.setFormatter(FastJSONLogFormatter())
+    records = [make_record(index) for index in range(NUMBER)]
+    latencies = []
+    start = time.perf_counter()
+    for record in records:
+        before = time.perf_counter_ns()
+        handler.handle(record)
+        latencies.append(time.perf_counter_ns() - before)
+    handler.close()
+    SEGMENT_COMPRESSOR.join()
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    return NUMBER / seconds, latencies[int(len(latencies) * 0.99)] / 1000
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        handlers = {
+            "RotatingFileHandler": lambda: RotatingFileHandler(
+                os.path.join(directory, "rotating.log"),
+                maxBytes=MAX_BYTES,
+                backupCount=30,
+            ),
+            "JSONLinesFileHandler": lambda: JSONLinesFileHandler(
+                os.path.join(directory, "json_lines.log"),
+                max_bytes=MAX_BYTES,
+                backup_count=30,
+            ),
+        }
+        for name, factory in handlers.items():
+            lines, p99 = run(factory())
+            print(f"{name:<22} {lines:>10,.0f} lines/s  p99 emit {p99:>7.1f}µs")
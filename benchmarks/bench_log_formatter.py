@@ -0,0 +1,79 @@
+"""
+Records/sec of JSONLogFormatter vs FastJSONLogFormatter
+
+    PYTHONPATH=. python benchmarks/bench_log_formatter.py
+
+The orjson backend runs when orjson is installed. Each line is compared to
+JSONLogFormatter's: byte-identical for the json backend, the same document
+for orjson. It exits 1 when a line does not match.
+"""
+import json
+import logging
+import sys
+import timeit
+
+from fastapi_app.core.logging_formatter import (
+    FastJSONLogFormatter,
+    JSONLogFormatter,
+    orjson,
+)
+
+NUMBER = 20_000
+
+
+def make_record() -> logging.LogRecord:
+    record = logging.LogRecord(
+        "main",
+        logging.INFO,
+        __file__,
+        1,
+        '127.0.0.1:59354 - "GET    http://localhost:8000/ HTTP/1.1" 200 "OK" 3ms',
+        None,
+        None,
+    )
+    # NOTE: fixed, outside a request every format would draw a new one
+    record.trace_id = "d8cc300ce77a4454a3db6487640f0f66"
+    record.request_json_fields = {
+        "request_uri": "http://localhost:8000/",
+        "request_method": "GET",
+        "request_path": "/",
+        "request_headers": {"host": "localhost:8000", "accept": "*/*"},
+        "response_status_code": 200,
+        "response_size": 23,
+        "response_body": '{"message": "Hello"}',
+        "duration": 3,
+    }
+    return record
+
+
+if __name__ == "__main__":
+    record = make_record()
+    formatters = {
+        "JSONLogFormatter": JSONLogFormatter(),
+        "FastJSONLogFormatter(json)": FastJSONLogFormatter(),
+    }
+    if orjson is not None:
+        formatters["FastJSONLogFormatter(orjson)"] = FastJSONLogFormatter(
+            backend="orjson"
+        )
+
+    expected = formatters["JSONLogFormatter"].format(record)
+    failures = []
+    for name, formatter in formatters.items():
+        seconds = min(
+            timeit.repeat(lambda: formatter.format(record), number=NUMBER, repeat=5)
+        )
+        line = formatter.format(record)
+        if line == expected:
+            match = "byte-identical"
+        elif json.loads(line) == json.loads(expected):
+            match = "same document"
+        else:
+            match = "different"
+        print(f"{name:<30} {NUMBER / seconds:>10,.0f} records/s  {match}")
+        orjson_backend = getattr(formatter, "backend", None) == "orjson"
+        if match == "different" or (match != "byte-identical" and not orjson_backend):
+            failures.append(name)
+    for name in failures:
+        print(f"FAILED {name} does not match JSONLogFormatter")
+    sys.exit(1 if failures else 0)
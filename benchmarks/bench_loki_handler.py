@@ -0,0 +1,224 @@
+"""
+End-to-end throughput and delivery checks of LokiHandler against a local
+fake Loki push API
+
+    PYTHONPATH=. python benchmarks/bench_loki_handler.py
+
+The fake server decompresses and parses every push. The throughput runs
+fail the first pushes with 503 so the retry path is exercised too. Then
+the run checks:
+- delivery: every record arrives exactly once with its stream labels, and
+  the sent and push failure counters match the fake's pushes
+- a 400 is not retried and its batch is counted as dropped (push_failed)
+- while a push hangs, records past ``max_buffer`` are dropped oldest first
+  (buffer_full) and the others are delivered once the push returns
+It exits 1 when a check fails.
+"""
+import gzip
+import json
+import logging
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+from prometheus_client import REGISTRY
+
+from fastapi_app.core.logging_formatter import FastJSONLogFormatter
+from fastapi_app.core.loki_handler import LokiHandler
+
+NUMBER = 50_000
+FAILED_PUSHES = 2
+LABELS = {"app_name": "bench", "env": "dev"}
+
+
+class FakeLokiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fail_status: int = 503, failed_pushes: int = 0) -> None:
+        super().__init__(("127.0.0.1", 0), FakeLoki)
+        self.fail_status = fail_status
+        self.failed_pushes = failed_pushes
+        self.lock = threading.Lock()
+        self.pushes = 0
+        self.payload_bytes = 0
+        self.streams: List[dict] = []
+        # NOTE: cleared to hold pushes, received is set when one is waiting
+        self.release = threading.Event()
+        self.release.set()
+        self.received = threading.Event()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/loki/api/v1/push"
+
+    def lines(self) -> List[str]:
+        return [line for stream in self.streams for _, line in stream["values"]]
+
+    def stop(self) -> None:
+        self.release.set()
+        self.shutdown()
+        self.server_close()
+
+
+class FakeLoki(BaseHTTPRequestHandler):
+    server: FakeLokiServer
+
+    def do_POST(self) -> None:
+        server = self.server
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        server.received.set()
+        server.release.wait()
+        with server.lock:
+            server.pushes += 1
+            failed = server.pushes <= server.failed_pushes
+        if failed:
+            self.send_response(server.fail_status)
+            self.end_headers()
+            return
+        body_size = len(body)
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        streams = json.loads(body)["streams"]
+        with server.lock:
+            server.payload_bytes += body_size
+            server.streams.extend(streams)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def counters() -> dict:
+    return {
+        "sent": sample("fastapi_loki_records_sent_total"),
+        "push_failures": sample("fastapi_loki_push_failures_total"),
+        "buffer_full": sample(
+            "fastapi_loki_records_dropped_total", reason="buffer_full"
+        ),
+        "push_failed": sample(
+            "fastapi_loki_records_dropped_total", reason="push_failed"
+        ),
+    }
+
+
+def delta(before: dict) -> dict:
+    return {key: value - before[key] for key, value in counters().items()}
+
+
+def build_handler(server: FakeLokiServer, **options) -> LokiHandler:
+    options.setdefault("backoff", 0.05)
+    handler = LokiHandler(server.url, labels=LABELS, **options)
+    handler.setFormatter(FastJSONLogFormatter())
+    return handler
+
+
+def emit(handler: LokiHandler, start: int, stop: int, level: int = logging.INFO):
+    for index in range(start, stop):
+        record = logging.LogRecord(
+            "main", level, __file__, 1, "request %s", (index,), None
+        )
+        handler.handle(record)
+
+
+def sequence(server: FakeLokiServer) -> List[int]:
+    return [int(json.loads(line)["message"].split()[-1]) for line in server.lines()]
+
+
+def run(compress: bool) -> List[str]:
+    server = FakeLokiServer(failed_pushes=FAILED_PUSHES)
+    handler = build_handler(server, max_buffer=NUMBER, compress=compress)
+    before = counters()
+
+    start = time.perf_counter()
+    emit(handler, 0, NUMBER)
+    emitted = time.perf_counter() - start
+    handler.close()
+    delivered = time.perf_counter() - start
+    server.stop()
+    changes = delta(before)
+
+    print(
+        f"compress={compress!s:<5} emit {NUMBER / emitted:>9,.0f} records/s  "
+        f"delivered {len(server.lines()) / delivered:>9,.0f} records/s  "
+        f"{server.pushes} pushes  {server.payload_bytes / 1024:,.0f}KiB sent"
+    )
+    failures = []
+    if sorted(sequence(server)) != list(range(NUMBER)):
+        failures.append(f"compress={compress}: records lost or delivered twice")
+    if any(
+        stream["stream"] != {**LABELS, "level": "INFO"} for stream in server.streams
+    ):
+        failures.append(f"compress={compress}: unexpected stream labels")
+    if changes["sent"] != NUMBER or changes["push_failures"] != FAILED_PUSHES:
+        failures.append(f"compress={compress}: sent or push failure counters are off")
+    return failures
+
+
+def check_not_retried() -> List[str]:
+    server = FakeLokiServer(fail_status=400, failed_pushes=1)
+    handler = build_handler(server, batch_size=100)
+    before = counters()
+    emit(handler, 0, 100, logging.WARNING)
+    handler.close()
+    server.stop()
+    changes = delta(before)
+    print(
+        f"400 response         {server.pushes} push, "
+        f"{changes['push_failed']:.0f} records dropped (push_failed)"
+    )
+    if server.pushes != 1 or changes["push_failed"] != 100 or changes["sent"]:
+        return ["a 400 response was retried or its batch was not counted"]
+    return []
+
+
+def check_buffer_full(batch_size: int = 100, max_buffer: int = 1000) -> List[str]:
+    server = FakeLokiServer()
+    server.release.clear()
+    handler = build_handler(
+        server, batch_size=batch_size, max_buffer=max_buffer, flush_interval=60
+    )
+    before = counters()
+    # NOTE: a full batch wakes the sender, which then hangs in its push
+    emit(handler, 0, batch_size)
+    if not server.received.wait(5):
+        handler.close()
+        server.stop()
+        return ["the sender did not push a full batch"]
+    emit(handler, batch_size, batch_size + 3 * max_buffer)
+    dropped = delta(before)["buffer_full"]
+    server.release.set()
+    handler.close()
+    server.stop()
+    received = sequence(server)
+    print(
+        f"push hanging         {dropped:.0f} records dropped (buffer_full), "
+        f"{len(received)} delivered"
+    )
+    # NOTE: the first batch was taken by the sender, the buffer keeps the newest
+    newest = range(batch_size + 2 * max_buffer, batch_size + 3 * max_buffer)
+    expected = list(range(batch_size)) + list(newest)
+    if dropped != 2 * max_buffer or sorted(received) != expected:
+        return ["records past max_buffer were not dropped oldest first"]
+    return []
+
+
+def main() -> int:
+    failures = run(compress=True)
+    failures += run(compress=False)
+    failures += check_not_retried()
+    failures += check_buffer_full()
+    for failure in failures:
+        print(f"FAILED {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""
+Per-layer request overhead of the main.py app
+
+    PYTHONPATH=. python benchmarks/bench_middleware.py [--output results.json]
+        [--baseline baseline.json --tolerance 0.15] [--combinations]
+
+Every configuration builds the app with ``main.create_app``, turning the
+observability layers on and off: PrometheusMiddleware (``prometheus``),
+FastAPIInstrumentor (``tracing``), LoggingInstrumentor (``log_correlation``)
+and UltimateLoggingMiddleware (``ultimate_logging``). Requests are driven
+in-process through ``httpx.ASGITransport`` and spans are exported to a local
+no-op OTLP gRPC collector. By default the baseline (no layer), each layer
+alone and all layers run, ``--combinations`` runs every combination.
+
+Each scenario reports requests/s, p50/p99 latency and the peak memory
+allocated per request (tracemalloc, measured in a separate pass). With
+``--baseline`` the run fails when a throughput drops or a p99 grows by more
+than ``--tolerance`` compared to the stored results.
+"""
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent import futures
+from typing import Dict, List, Tuple
+
+import grpc
+import httpx
+from opentelemetry.instrumentation.logging import LoggingInstrumentor
+from opentelemetry.proto.collector.trace.v1 import (
+    trace_service_pb2,
+    trace_service_pb2_grpc,
+)
+from starlette.responses import Response, StreamingResponse
+
+LAYERS = ("prometheus", "tracing", "log_correlation", "ultimate_logging")
+REQUESTS = 1000
+ALLOCATION_REQUESTS = 100
+ROUTES = 500
+# NOTE: pre-serialized, the scenario measures the middlewares, not FastAPI's encoder
+LARGE_BODY = json.dumps(
+    {"items": [{"id": index, "name": f"item {index}"} for index in range(20000)]}
+).encode()
+STREAM_CHUNKS = 100
+
+
+class NoopTraceService(trace_service_pb2_grpc.TraceServiceServicer):
+    def Export(self, request, context):  # noqa: N802
+        return trace_service_pb2.ExportTraceServiceResponse()
+
+
+def start_collector() -> Tuple[grpc.Server, str]:
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    trace_service_pb2_grpc.add_TraceServiceServicer_to_server(
+        NoopTraceService(), server
+    )
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    return server, f"http://127.0.0.1:{port}"
+
+
+def silence_console() -> None:
+    """Keep the layers' console handlers but write them to /dev/null"""
+    devnull = open(os.devnull, "w")
+    loggers = [logging.getLogger()] + [
+        logger
+        for logger in logging.Logger.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)
+    ]
+    for logger in loggers:
+        for handler in logger.handlers:
+            if type(handler) is logging.StreamHandler:
+                handler.setStream(devnull)
+
+
+def build_app(main, layers: Dict[str, bool]):
+    instrumentor = LoggingInstrumentor()
+    if instrumentor.is_instrumented_by_opentelemetry:
+        instrumentor.uninstrument()
+    # NOTE: drop the root handler logging.basicConfig added for the otel format
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.setLevel(logging.WARNING)
+    app = main.create_app(**layers, upstreams=False)
+
+    async def large():
+        return Response(LARGE_BODY, media_type="application/json")
+
+    async def stream():
+        async def chunks():
+            for _ in range(STREAM_CHUNKS):
+                yield b"x" * 1024
+
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    async def item(item_id: int):
+        return {"item_id": item_id}
+
+    app.add_api_route("/large", large)
+    app.add_api_route("/stream", stream)
+    for index in range(ROUTES):
+        app.add_api_route(f"/routes/{index}/{{item_id}}", item)
+    silence_console()
+    return app
+
+
+SCENARIOS = {
+    "root": "/",
+    "large_body": "/large",
+    "streaming_body": "/stream",
+    "many_routes": f"/routes/{ROUTES - 1}/42",
+}
+
+
+async def measure(app, path: str) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    client = httpx.AsyncClient(transport=transport, base_url="http://bench")
+    async with client:
+        for _ in range(20):
+            (await client.get(path)).raise_for_status()
+
+        latencies: List[float] = []
+        start = time.perf_counter()
+        for _ in range(REQUESTS):
+            before = time.perf_counter()
+            await client.get(path)
+            latencies.append(time.perf_counter() - before)
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        peak = 0
+        for _ in range(ALLOCATION_REQUESTS):
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            await client.get(path)
+            peak += tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "requests_per_second": REQUESTS / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "alloc_peak_kib": peak / ALLOCATION_REQUESTS / 1024,
+    }
+
+
+def configurations(combinations: bool) -> Dict[str, Dict[str, bool]]:
+    if combinations:
+        enabled = itertools.product((False, True), repeat=len(LAYERS))
+    else:
+        enabled = [(False,) * len(LAYERS), (True,) * len(LAYERS)] + [
+            tuple(layer == index for layer in range(len(LAYERS)))
+            for index in range(len(LAYERS))
+        ]
+    result = {}
+    for flags in enabled:
+        layers = dict(zip(LAYERS, flags))
+        name = "+".join(layer for layer in LAYERS if layers[layer]) or "none"
+        result[name] = layers
+    return result
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    regressions = []
+    for config, scenarios in results.items():
+        for scenario, current in scenarios.items():
+            stored = baseline.get(config, {}).get(scenario)
+            if stored is None:
+                continue
+            if current["requests_per_second"] < stored["requests_per_second"] * (
+                1 - tolerance
+            ):
+                regressions.append(
+                    f"{config}/{scenario}: {current['requests_per_second']:,.0f} req/s"
+                    f" < {stored['requests_per_second']:,.0f} req/s"
+                )
+            if current["p99_ms"] > stored["p99_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"{config}/{scenario}: p99 {current['p99_ms']:.3f}ms"
+                    f" > {stored['p99_ms']:.3f}ms"
+                )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="compare with stored JSON results")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--combinations", action="store_true")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    collector, endpoint = start_collector()
+    os.environ["OTLP_GRPC_ENDPOINT"] = endpoint
+    # NOTE: the file log handler writes to ./static/logs/logs.log
+    workdir = tempfile.mkdtemp(prefix="bench-middleware-")
+    os.makedirs(os.path.join(workdir, "static", "logs"))
+    os.chdir(workdir)
+    # NOTE: main reads the environment above when imported
+    main_module = importlib.import_module("fastapi_app.main")
+
+    results: Dict[str, Dict[str, dict]] = {}
+    for name, layers in configurations(args.combinations).items():
+        app = build_app(main_module, layers)
+        results[name] = {}
+        for scenario, path in SCENARIOS.items():
+            result = asyncio.run(measure(app, path))
+            results[name][scenario] = result
+            print(
+                f"{name:<50} {scenario:<15}"
+                f" {result['requests_per_second']:>8,.0f} req/s"
+                f"  p50 {result['p50_ms']:>7.3f}ms  p99 {result['p99_ms']:>7.3f}ms"
+                f"  {result['alloc_peak_kib']:>8.1f}KiB/req"
+            )
+    collector.stop(None)
+
+    if output:
+        with open(output, "w") as file:
+            json.dump(results, file, indent=2)
+    if baseline_path:
+        with open(baseline_path) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
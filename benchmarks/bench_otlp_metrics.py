@@ -0,0 +1,196 @@
+"""
+OTLP push-mode request metrics against a local fake OTLP collector
+
+    PYTHONPATH=. python benchmarks/bench_otlp_metrics.py [--requests 3000]
+
+Builds the main.py app with ``otlp_metrics=True`` (and no tracing), drives
+requests through ``httpx.ASGITransport`` and exports every 200ms to an
+in-process OTLP gRPC collector. The deltas received are summed and compared
+with the Prometheus samples recorded for the same requests, the run exits 1
+on a mismatch. The request rate with and without the OTLP layer is printed.
+"""
+import argparse
+import asyncio
+import importlib
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent import futures
+from typing import Dict, FrozenSet, List, Tuple
+
+import grpc
+import httpx
+from opentelemetry.proto.collector.metrics.v1 import (
+    metrics_service_pb2,
+    metrics_service_pb2_grpc,
+)
+from opentelemetry.proto.metrics.v1.metrics_pb2 import AggregationTemporality
+from prometheus_client import REGISTRY
+
+PATHS = ("/items/1", "/items/2", "/fail", "/")
+APP_NAME = "bench"
+
+Key = Tuple[str, FrozenSet[Tuple[str, str]]]
+
+
+class FakeCollector(metrics_service_pb2_grpc.MetricsServiceServicer):
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.exports = 0
+        self.sums: Dict[Key, float] = {}
+        self.histograms: Dict[Key, List[float]] = {}
+        self.gauges: Dict[Key, float] = {}
+        self.errors: List[str] = []
+
+    def Export(self, request, context):  # noqa: N802
+        with self.lock:
+            self.exports += 1
+            for resource_metrics in request.resource_metrics:
+                for scope_metrics in resource_metrics.scope_metrics:
+                    for metric in scope_metrics.metrics:
+                        self.add(metric)
+        return metrics_service_pb2.ExportMetricsServiceResponse()
+
+    def add(self, metric) -> None:
+        kind = metric.WhichOneof("data")
+        data = getattr(metric, kind)
+        for point in data.data_points:
+            key = (
+                metric.name,
+                frozenset(
+                    (attribute.key, attribute.value.string_value)
+                    for attribute in point.attributes
+                ),
+            )
+            if kind == "histogram":
+                if data.aggregation_temporality != AggregationTemporality.AGGREGATION_TEMPORALITY_DELTA:
+                    self.errors.append(f"{metric.name} is not delta")
+                count, total = self.histograms.get(key, [0, 0.0])
+                self.histograms[key] = [count + point.count, total + point.sum]
+            elif data.is_monotonic:
+                if data.aggregation_temporality != AggregationTemporality.AGGREGATION_TEMPORALITY_DELTA:
+                    self.errors.append(f"{metric.name} is not delta")
+                self.sums[key] = self.sums.get(key, 0) + point.as_int
+            else:
+                self.gauges[key] = point.as_int
+
+
+def start_collector(collector: FakeCollector) -> Tuple[grpc.Server, str]:
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    metrics_service_pb2_grpc.add_MetricsServiceServicer_to_server(collector, server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    return server, f"http://127.0.0.1:{port}"
+
+
+def build_app(main, otlp_metrics: bool):
+    app = main.create_app(
+        tracing=False,
+        log_correlation=False,
+        otlp_metrics=otlp_metrics,
+        upstreams=False,
+    )
+
+    async def item(item_id: int):
+        return {"item_id": item_id}
+
+    async def fail():
+        raise ValueError("boom")
+
+    app.add_api_route("/items/{item_id}", item)
+    app.add_api_route("/fail", fail)
+    return app
+
+
+async def drive(app, number: int) -> float:
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for index in range(100):
+            await client.get(PATHS[index % len(PATHS)])
+        start = time.perf_counter()
+        for index in range(number):
+            await client.get(PATHS[index % len(PATHS)])
+        elapsed = time.perf_counter() - start
+    return number / elapsed
+
+
+def prometheus_values() -> Dict[Key, float]:
+    values = {}
+    for metric in REGISTRY.collect():
+        for sample in metric.samples:
+            if sample.labels.get("app_name") != APP_NAME:
+                continue
+            key = (sample.name, frozenset(sample.labels.items()))
+            values[key] = sample.value
+    return values
+
+
+def compare(before, after, collector: FakeCollector) -> List[str]:
+    expected = {key: after[key] - before.get(key, 0.0) for key in after}
+    mismatches = list(collector.errors)
+
+    def check(name: str, labels: FrozenSet, value: float) -> None:
+        wanted = expected.get((name, labels), 0.0)
+        if not math.isclose(value, wanted, rel_tol=1e-9, abs_tol=1e-9):
+            mismatches.append(f"{name}{dict(labels)}: otlp {value} != prometheus {wanted}")
+
+    for (name, labels), value in collector.sums.items():
+        check(name, labels, value)
+    for (name, labels), (count, total) in collector.histograms.items():
+        check(name + "_count", labels, count)
+        check(name + "_sum", labels, total)
+    for (name, labels), value in collector.gauges.items():
+        check(name, labels, value)
+    for name, labels in expected:
+        if name.endswith("_total") and (name, labels) not in collector.sums and expected[(name, labels)]:
+            mismatches.append(f"{name}{dict(labels)} missing from the OTLP export")
+    return mismatches
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=3000)
+    args = parser.parse_args()
+
+    collector = FakeCollector()
+    server, endpoint = start_collector(collector)
+    os.environ.update(
+        OTLP_GRPC_ENDPOINT=endpoint,
+        APP_NAME=APP_NAME,
+        OTLP_METRICS_EXPORT_INTERVAL_MILLIS="200",
+        TRACING_ENABLE="false",
+    )
+    # NOTE: the file log handler writes to ./static/logs/logs.log
+    workdir = tempfile.mkdtemp(prefix="bench-otlp-metrics-")
+    os.makedirs(os.path.join(workdir, "static", "logs"))
+    os.chdir(workdir)
+    # NOTE: main reads the environment above when imported
+    main_module = importlib.import_module("fastapi_app.main")
+
+    plain = build_app(main_module, otlp_metrics=False)
+    plain_rate = asyncio.run(drive(plain, args.requests))
+
+    before = prometheus_values()
+    app = build_app(main_module, otlp_metrics=True)
+    otlp_rate = asyncio.run(drive(app, args.requests))
+    after = prometheus_values()
+    # NOTE: the shutdown handler flushes the last deltas
+    asyncio.run(app.router.shutdown())
+    server.stop(None)
+
+    print(f"prometheus only      {plain_rate:>8,.0f} req/s")
+    print(f"prometheus + otlp    {otlp_rate:>8,.0f} req/s")
+    print(f"otlp exports         {collector.exports:>8}")
+    mismatches = compare(before, after, collector)
+    for mismatch in mismatches:
+        print(f"MISMATCH {mismatch}")
+    if not mismatches:
+        print("otlp values match the prometheus samples")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Span pipeline health metrics under a synthetic flood, against a local fake
+OTLP gRPC collector
+
+    PYTHONPATH=. python benchmarks/bench_span_export.py [--spans 20000]
+        [--max-queue-size 2048] [--max-export-batch-size 512]
+        [--export-delay-ms 50] [--failures 2]
+
+The spans go through ``InstrumentedBatchSpanProcessor`` and the OTLP gRPC
+exporter, wired like ``setting_otlp`` does. The collector answers every
+export after ``--export-delay-ms``, so the queue fills up and spans are
+dropped. It rejects the first ``--failures`` exports with INVALID_ARGUMENT,
+which the exporter does not retry. After the flush the run checks:
+- ``fastapi_otel_spans_dropped_total`` against the spans that never reached
+  the exporter
+- the count and sum of ``fastapi_otel_export_batch_size`` against the
+  export calls and spans the collector received, and the largest batch
+  against ``--max-export-batch-size``
+- ``fastapi_otel_export_failures_total`` against the rejected exports
+- ``fastapi_otel_span_queue_depth``: full during the flood, empty after it
+It exits 1 when a number does not match. With PROMETHEUS_MULTIPROC_DIR set
+the numbers are read from the multiprocess files, like /metrics serves them.
+"""
+import argparse
+import sys
+import threading
+import time
+from concurrent import futures
+from typing import List, Tuple
+
+import grpc
+from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+from opentelemetry.proto.collector.trace.v1 import (
+    trace_service_pb2,
+    trace_service_pb2_grpc,
+)
+from opentelemetry.sdk.trace import TracerProvider
+from prometheus_client import REGISTRY
+
+from fastapi_app.core.multiprocess import collect_multiprocess, is_multiprocess_mode
+from fastapi_app.core.span_export import InstrumentedBatchSpanProcessor
+
+
+class FakeTraceService(trace_service_pb2_grpc.TraceServiceServicer):
+    def __init__(self, export_delay: float, failures: int) -> None:
+        self.export_delay = export_delay
+        self.failures = failures
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.rejected_calls = 0
+        self.received_spans = 0
+        self.rejected_spans = 0
+        self.largest_batch = 0
+
+    def Export(self, request, context):  # noqa: N802
+        spans = sum(
+            len(scope_spans.spans)
+            for resource_spans in request.resource_spans
+            for scope_spans in resource_spans.scope_spans
+        )
+        time.sleep(self.export_delay)
+        with self.lock:
+            self.calls += 1
+            self.largest_batch = max(self.largest_batch, spans)
+            if self.calls <= self.failures:
+                self.rejected_calls += 1
+                self.rejected_spans += spans
+                context.abort(grpc.StatusCode.INVALID_ARGUMENT, "rejected")
+            self.received_spans += spans
+        return trace_service_pb2.ExportTraceServiceResponse()
+
+
+def start_collector(service: FakeTraceService) -> Tuple[grpc.Server, str]:
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    trace_service_pb2_grpc.add_TraceServiceServicer_to_server(service, server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    return server, f"http://127.0.0.1:{port}"
+
+
+def sample(name: str, **labels) -> float:
+    # NOTE: read like /metrics does, from the mmap files in multiprocess mode
+    families = collect_multiprocess() if is_multiprocess_mode() else REGISTRY.collect()
+    for family in families:
+        for metric_sample in family.samples:
+            if metric_sample.name == name and metric_sample.labels == labels:
+                return metric_sample.value
+    return 0.0
+
+
+def snapshot() -> dict:
+    return {
+        "dropped": sample("fastapi_otel_spans_dropped_total"),
+        "batches": sample("fastapi_otel_export_batch_size_count"),
+        "batched_spans": sample("fastapi_otel_export_batch_size_sum"),
+        "failures": sample("fastapi_otel_export_failures_total"),
+        "export_seconds": sample("fastapi_otel_export_duration_seconds_sum"),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--spans", type=int, default=20000)
+    parser.add_argument("--max-queue-size", type=int, default=2048)
+    parser.add_argument("--max-export-batch-size", type=int, default=512)
+    parser.add_argument("--export-delay-ms", type=float, default=50)
+    parser.add_argument("--failures", type=int, default=2)
+    args = parser.parse_args()
+
+    service = FakeTraceService(args.export_delay_ms / 1000, args.failures)
+    server, endpoint = start_collector(service)
+    processor = InstrumentedBatchSpanProcessor(
+        OTLPSpanExporter(endpoint=endpoint, insecure=True),
+        max_queue_size=args.max_queue_size,
+        max_export_batch_size=args.max_export_batch_size,
+        schedule_delay_millis=100,
+    )
+    provider = TracerProvider()
+    provider.add_span_processor(processor)
+    tracer = provider.get_tracer(__name__)
+
+    before = snapshot()
+    peak_depth = 0.0
+    start = time.perf_counter()
+    for index in range(args.spans):
+        tracer.start_span("flood").end()
+        if index % 100 == 0:
+            peak_depth = max(peak_depth, sample("fastapi_otel_span_queue_depth"))
+    flood_seconds = time.perf_counter() - start
+    provider.shutdown()
+    final_depth = sample("fastapi_otel_span_queue_depth")
+    server.stop(None)
+    after = snapshot()
+    delta = {key: after[key] - before[key] for key in after}
+
+    print(f"flood                {args.spans / flood_seconds:>10,.0f} spans/s")
+    print(f"peak queue depth     {peak_depth:>10,.0f} / {args.max_queue_size}")
+    print(f"spans dropped        {delta['dropped']:>10,.0f}")
+    print(
+        f"export calls         {delta['batches']:>10,.0f}"
+        f"  mean {delta['batched_spans'] / max(delta['batches'], 1):,.0f} spans,"
+        f" {delta['export_seconds'] / max(delta['batches'], 1) * 1000:.1f}ms"
+    )
+    print(f"export failures      {delta['failures']:>10,.0f}")
+    print(
+        f"collector            {service.received_spans:>10,} spans received,"
+        f" {service.rejected_spans:,} rejected"
+    )
+
+    failures: List[str] = []
+    if not delta["dropped"]:
+        failures.append("the flood did not fill the queue, raise --spans")
+    if delta["dropped"] != args.spans - delta["batched_spans"]:
+        failures.append("dropped spans do not match the spans never exported")
+    if delta["batched_spans"] != service.received_spans + service.rejected_spans:
+        failures.append("batch size sum does not match the collector")
+    if delta["batches"] != service.calls:
+        failures.append("batch size count does not match the export calls")
+    if service.largest_batch > args.max_export_batch_size:
+        failures.append("a batch is larger than max_export_batch_size")
+    if delta["failures"] != service.rejected_calls:
+        failures.append("export failures do not match the rejected exports")
+    if peak_depth != args.max_queue_size or final_depth:
+        failures.append("queue depth was not full during the flood or not empty after")
+    for failure in failures:
+        print(f"FAILED {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
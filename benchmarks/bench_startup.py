@@ -0,0 +1,108 @@
+"""
+Cold start of the app entry point: import time and time-to-first-response
+
+    PYTHONPATH=. python benchmarks/bench_startup.py [--runs 5] [--no-tracing]
+        [--import-budget-ms 1500] [--first-response-budget-ms 2000]
+
+Each run starts a fresh interpreter that imports ``fastapi_app.main`` and
+sends one request through ``httpx.ASGITransport``. ``first_response_ms``
+counts from the start of the import to the first response. The medians are
+compared with the budgets and the run exits 1 when one is exceeded. The
+optional heavy modules loaded by the start are listed, they should only
+appear when their feature is enabled.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+OPTIONAL_MODULES = (
+    "grpc",
+    "opentelemetry.exporter.otlp.proto.grpc.trace_exporter",
+    "opentelemetry.instrumentation.fastapi",
+    "opentelemetry.instrumentation.logging",
+    "stackprinter",
+    "loguru",
+    "fastapi_app.core.upstream",
+    "fastapi_app.core.loki_handler",
+    "fastapi_app.core.log_file_sink",
+)
+
+CHILD = """
+import asyncio, importlib, json, os, sys, time
+
+start = time.perf_counter()
+main = importlib.import_module("fastapi_app.main")
+imported = time.perf_counter()
+
+import httpx
+
+
+async def first_response():
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://b") as client:
+        (await client.get("/")).raise_for_status()
+
+
+asyncio.run(first_response())
+responded = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_response_ms": (responded - start) * 1000,
+    "modules": [name for name in %r if name in sys.modules],
+}), flush=True)
+# NOTE: skip the span processor's shutdown export to a missing collector
+os._exit(0)
+"""
+
+
+def run_once(tracing: bool) -> dict:
+    env = dict(os.environ, TRACING_ENABLE="true" if tracing else "false")
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [os.getcwd(), env.get("PYTHONPATH")])
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD % (OPTIONAL_MODULES,)],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--no-tracing", action="store_true")
+    parser.add_argument("--import-budget-ms", type=float, default=1500)
+    parser.add_argument("--first-response-budget-ms", type=float, default=2000)
+    args = parser.parse_args()
+
+    runs = [run_once(tracing=not args.no_tracing) for _ in range(args.runs)]
+    import_ms = statistics.median(run["import_ms"] for run in runs)
+    first_response_ms = statistics.median(run["first_response_ms"] for run in runs)
+    print(
+        f"import             {import_ms:>8.1f}ms"
+        f"  (budget {args.import_budget_ms:g}ms)"
+    )
+    print(
+        f"first response     {first_response_ms:>8.1f}ms"
+        f"  (budget {args.first_response_budget_ms:g}ms)"
+    )
+    print(f"optional modules   {', '.join(runs[-1]['modules']) or '-'}")
+
+    over = []
+    if import_ms > args.import_budget_ms:
+        over.append("import")
+    if first_response_ms > args.first_response_budget_ms:
+        over.append("first response")
+    for name in over:
+        print(f"OVER BUDGET {name}")
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Pooled upstream clients against local stand-in services
+
+    PYTHONPATH=. python benchmarks/bench_upstream_client.py [--requests 2000]
+        [--concurrency 32] [--max-connections 8]
+
+Two stand-in services (threaded HTTP/1.1 keep-alive servers) record the
+``traceparent`` header they receive. ``UpstreamClients`` calls them
+concurrently through the pool, then a client per request (what handlers
+would do without a shared client) is timed for comparison. The run checks
+that every request carried the trace context of its CLIENT span, that the
+duration/in-flight/pool-wait/error metrics add up (a closed port provides
+the connection errors) and exits 1 otherwise.
+"""
+import argparse
+import asyncio
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+import httpx
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+    InMemorySpanExporter,
+)
+from prometheus_client import REGISTRY
+
+from fastapi_app.core.upstream import UpstreamClients, UpstreamConfig
+
+SPANS = InMemorySpanExporter()
+
+
+class StandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    traceparents: List[str] = []
+    lock = threading.Lock()
+
+    def setup(self) -> None:
+        super().setup()
+        # NOTE: headers and body are two writes, avoid Nagle + delayed ACK stalls
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def do_GET(self) -> None:
+        with StandIn.lock:
+            StandIn.traceparents.append(self.headers.get("traceparent", ""))
+        body = b'{"message": "Hello"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def start_stand_in() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+async def run_pooled(
+    clients: UpstreamClients, names, number: int, concurrency: int
+) -> float:
+    queue = list(range(number))
+
+    async def worker() -> None:
+        while queue:
+            index = queue.pop()
+            response = await clients[names[index % len(names)]].get("/")
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return number / (time.perf_counter() - start)
+
+
+async def run_unpooled(urls, number: int, concurrency: int) -> float:
+    queue = list(range(number))
+
+    async def worker() -> None:
+        while queue:
+            index = queue.pop()
+            async with httpx.AsyncClient() as client:
+                (await client.get(urls[index % len(urls)])).raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return number / (time.perf_counter() - start)
+
+
+async def run(args) -> List[str]:
+    servers = [start_stand_in(), start_stand_in()]
+    urls = [f"http://127.0.0.1:{server.server_port}" for server in servers]
+    upstreams = {
+        f"stand_in_{index}": UpstreamConfig(
+            url,
+            max_connections=args.max_connections,
+            max_keepalive_connections=args.max_connections,
+        )
+        for index, url in enumerate(urls)
+    }
+    upstreams["down"] = UpstreamConfig(f"http://127.0.0.1:{closed_port()}")
+    names = [name for name in upstreams if name != "down"]
+    clients = UpstreamClients(upstreams)
+    await clients.start()
+
+    tracer = trace.get_tracer(__name__)
+    with tracer.start_as_current_span("bench"):
+        pooled = await run_pooled(clients, names, args.requests, args.concurrency)
+        for _ in range(3):
+            try:
+                await clients["down"].get("/")
+            except httpx.ConnectError:
+                pass
+    await clients.aclose()
+    unpooled = await run_unpooled(urls, args.requests, args.concurrency)
+    for server in servers:
+        server.shutdown()
+
+    print(f"pooled clients       {pooled:>8,.0f} req/s")
+    print(f"client per request   {unpooled:>8,.0f} req/s")
+
+    failures = []
+    client_spans = {
+        format(span.context.span_id, "016x"): span
+        for span in SPANS.get_finished_spans()
+        if span.kind == trace.SpanKind.CLIENT
+    }
+    pooled_parents = StandIn.traceparents[: args.requests]
+    # NOTE: traceparent is version-trace_id-parent_id-flags
+    propagated = sum(
+        1
+        for header in pooled_parents
+        if header.count("-") == 3 and header.split("-")[2] in client_spans
+    )
+    print(f"traceparent          {propagated}/{len(pooled_parents)} from client spans")
+    if propagated != args.requests:
+        failures.append("trace context missing or not from the client span")
+
+    for name in names:
+        count = sample(
+            "fastapi_upstream_request_duration_seconds_count",
+            upstream=name,
+            method="GET",
+            status_code="200",
+        )
+        in_flight = sample("fastapi_upstream_requests_in_flight", upstream=name)
+        waits = sample("fastapi_upstream_pool_wait_seconds_count", upstream=name)
+        wait_sum = sample("fastapi_upstream_pool_wait_seconds_sum", upstream=name)
+        print(
+            f"{name:<20} {count:>6.0f} requests  in flight {in_flight:.0f}"
+            f"  mean pool wait {wait_sum / max(waits, 1) * 1000:.2f}ms"
+        )
+        if count != args.requests / len(names) or waits != count or in_flight:
+            failures.append(f"{name} metrics do not add up")
+    errors = sample(
+        "fastapi_upstream_errors_total", upstream="down", error_type="ConnectError"
+    )
+    print(f"down                 {errors:>6.0f} ConnectError")
+    if errors != 3 or sample("fastapi_upstream_requests_in_flight", upstream="down"):
+        failures.append("connection errors are not counted")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--max-connections", type=int, default=8)
+    args = parser.parse_args()
+
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(SPANS))
+    trace.set_tracer_provider(provider)
+
+    failures = asyncio.run(run(args))
+    for failure in failures:
+        print(f"FAILED {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+import threading
+from typing import Collection, Dict, Mapping, Optional, Set, Tuple
+
+from prometheus_client import Counter
+from prometheus_client.metrics import MetricWrapperBase
+
+OTHER = "__other__"
+OVERFLOW_LABELS = ("path", "status_code", "exception_type")
+
+FOLDED_OBSERVATIONS = Counter(
+    "fastapi_metric_folded_observations_total",
+    "Total count of observations folded into the __other__ label set by metric",
+    ["metric"],
+)
+
+
+class FoldedChild:
+    """Metric child that also counts every observation folded into it"""
+
+    __slots__ = ("child", "folded")
+
+    def __init__(self, child: MetricWrapperBase, folded: Counter) -> None:
+        self.child = child
+        self.folded = folded
+
+    def inc(self, amount: float = 1) -> None:
+        self.folded.inc()
+        self.child.inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        self.child.dec(amount)
+
+    def observe(self, amount: float, exemplar: Optional[Dict[str, str]] = None) -> None:
+        self.folded.inc()
+        self.child.observe(amount, exemplar)
+
+
+class CardinalityGuard:
+    """Bound the number of label sets per metric family.
+
+    - label values missing from ``allowlists[label]`` become ``__other__``
+    - once a family has ``max_label_sets`` distinct label sets, new ones get
+      their ``overflow_labels`` replaced by ``__other__``
+    - folded children are wrapped in ``FoldedChild`` so
+      ``fastapi_metric_folded_observations_total`` counts every observation
+
+    It only runs when a child is bound; callers cache the returned child so
+    the request path stays a dict lookup. ``max_label_sets=0`` means no cap.
+    """
+
+    def __init__(
+        self,
+        max_label_sets: int = 0,
+        allowlists: Optional[Mapping[str, Collection[str]]] = None,
+        overflow_labels: Collection[str] = OVERFLOW_LABELS,
+    ) -> None:
+        self.max_label_sets = max_label_sets
+        self.allowlists = {
+            name: frozenset(str(value) for value in values)
+            for name, values in (allowlists or {}).items()
+        }
+        self.overflow_labels = frozenset(overflow_labels)
+        self._seen: Dict[str, Set[Tuple[str, ...]]] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, metric: MetricWrapperBase, **labels):
+        if not self.max_label_sets and not self.allowlists:
+            return metric.labels(**labels)
+
+        names = metric._labelnames
+        values = tuple(str(labels[name]) for name in names)
+        guarded = tuple(
+            OTHER
+            if name in self.allowlists and value not in self.allowlists[name]
+            else value
+            for name, value in zip(names, values)
+        )
+
+        with self._lock:
+            seen = self._seen.setdefault(metric._name, set())
+            if guarded not in seen:
+                if self.max_label_sets and len(seen) >= self.max_label_sets:
+                    guarded = tuple(
+                        OTHER if name in self.overflow_labels else value
+                        for name, value in zip(names, guarded)
+                    )
+                else:
+                    seen.add(guarded)
+
+        child = metric.labels(*guarded)
+        if guarded != values:
+            return FoldedChild(child, FOLDED_OBSERVATIONS.labels(metric=metric._name))
+        return child
+
+
+NO_GUARD = CardinalityGuard()
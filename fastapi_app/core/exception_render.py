@@ -0,0 +1,131 @@
+import hashlib
+import logging
+import threading
+import time
+import traceback
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client import Counter
+
+from fastapi_app.core.settings import settings
+
+EXCEPTION_RENDERS_SUPPRESSED = Counter(
+    "fastapi_exception_renders_suppressed_total",
+    "Total count of exceptions logged with a summary instead of a full render",
+)
+
+SUPPRESSED_PATHS = [
+    r"lib/python.*/site-packages/starlette.*",
+]
+
+
+def fingerprint(exc_info) -> str:
+    """Stable id of an exception: its type and the code locations of its traceback"""
+    exc_type, _, tb = exc_info
+    parts = [f"{exc_type.__module__}.{exc_type.__qualname__}"]
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        parts.append(f"{code.co_filename}:{tb.tb_lineno}:{code.co_name}")
+        tb = tb.tb_next
+    return hashlib.blake2b("|".join(parts).encode(), digest_size=8).hexdigest()
+
+
+def summary(exc_info) -> str:
+    exc_type, exc_value, tb = exc_info
+    message = traceback.format_exception_only(exc_type, exc_value)[-1].strip()
+    if tb is None:
+        return message
+    while tb.tb_next is not None:
+        tb = tb.tb_next
+    code = tb.tb_frame.f_code
+    return f'{message} (File "{code.co_filename}", line {tb.tb_lineno}, in {code.co_name})'
+
+
+class ExceptionRenderer:
+    """Render an exception with stackprinter once per fingerprint and window.
+
+    Repeats inside ``window`` seconds, and any exception once ``budget`` full
+    renders were spent in the current window, are logged as fingerprint,
+    one-line summary and repeat count. ``window <= 0`` always renders.
+    """
+
+    def __init__(
+        self, window: float = 60.0, budget: int = 20, max_fingerprints: int = 1024
+    ) -> None:
+        self.window = window
+        self.budget = budget
+        self.max_fingerprints = max_fingerprints
+        # NOTE: fingerprint -> [window start, occurrences in window]
+        self._seen: Dict[str, List[float]] = {}
+        self._budget_start = 0.0
+        self._budget_used = 0
+        self._lock = threading.Lock()
+
+    def render(self, exc_info) -> List[str]:
+        if self.window <= 0:
+            return self.full(exc_info)
+
+        key = fingerprint(exc_info)
+        now = time.monotonic()
+        with self._lock:
+            render, count = self._account(key, now)
+
+        if render:
+            return [f"fingerprint={key}", *self.full(exc_info)]
+
+        EXCEPTION_RENDERS_SUPPRESSED.inc()
+        return [
+            f"fingerprint={key} repeated={count} in {self.window:g}s",
+            summary(exc_info),
+        ]
+
+    @staticmethod
+    def full(exc_info) -> List[str]:
+        # NOTE: imported on the first full render, it is slow to import
+        import stackprinter
+
+        return stackprinter.format(
+            exc_info,
+            suppressed_paths=SUPPRESSED_PATHS,
+            add_summary=False,
+        ).split("\n")
+
+    def _account(self, key: str, now: float) -> Tuple[bool, int]:
+        """Lock must be held by caller"""
+        if now - self._budget_start >= self.window:
+            self._budget_start, self._budget_used = now, 0
+
+        seen = self._seen.get(key)
+        if seen is not None and now - seen[0] < self.window:
+            seen[1] += 1
+            return False, int(seen[1])
+
+        if self.budget and self._budget_used >= self.budget:
+            return False, 1
+
+        if len(self._seen) >= self.max_fingerprints:
+            self._seen = {
+                fp: value
+                for fp, value in self._seen.items()
+                if now - value[0] < self.window
+            }
+        if len(self._seen) < self.max_fingerprints:
+            self._seen[key] = [now, 1]
+        self._budget_used += 1
+        return True, 1
+
+
+EXCEPTION_RENDERER = ExceptionRenderer(
+    window=settings.LOG_EXCEPTION_RENDER_WINDOW,
+    budget=settings.LOG_EXCEPTION_RENDER_BUDGET,
+)
+
+
+def render_exception(record: logging.LogRecord) -> Optional[List[str]]:
+    """Exception lines of a record, rendered once even with several handlers"""
+    if not record.exc_info:
+        return None
+    rendered = getattr(record, "exc_rendered", None)
+    if rendered is None:
+        rendered = record.exc_rendered = EXCEPTION_RENDERER.render(record.exc_info)
+    return rendered
@@ -0,0 +1,281 @@
+import math
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from prometheus_client import REGISTRY, CollectorRegistry
+from prometheus_client.metrics import MetricWrapperBase, _use_created, _validate_exemplar
+from prometheus_client.metrics_core import Metric
+from prometheus_client.samples import Exemplar, Sample
+from prometheus_client.utils import INF, floatToGoString
+
+MIN_SCHEMA = -4
+MAX_SCHEMA = 8
+# NOTE: same default as the Go client, observations up to it go to the zero bucket
+ZERO_THRESHOLD = 2.0**-128
+# NOTE: 2^-11s (~0.5ms) .. 2^6s (64s), then +Inf
+CLASSIC_EXPONENTS = (-11, 6)
+
+# NOTE: upper bounds of the buckets within one power of two, as math.frexp fractions
+_FRACTION_BOUNDS = {
+    schema: [2.0 ** (index / 2**schema - 1) for index in range(2**schema)]
+    for schema in range(1, MAX_SCHEMA + 1)
+}
+
+
+def bucket_index(value: float, schema: int) -> int:
+    """Index of the bucket ``(base^(index-1), base^index]``, ``base = 2^(2^-schema)``
+
+    Computed from the exact mantissa and exponent, so values on a bucket
+    boundary never land in the neighbour bucket because of log rounding.
+    """
+    fraction, exponent = math.frexp(value)
+    if schema > 0:
+        bounds = _FRACTION_BOUNDS[schema]
+        return bisect_left(bounds, fraction) + (exponent - 1) * len(bounds)
+    index = exponent - 1 if fraction == 0.5 else exponent
+    if schema < 0:
+        index = (index + (1 << -schema) - 1) >> -schema
+    return index
+
+
+def exponential_bounds(min_exponent: int, max_exponent: int) -> List[float]:
+    """Classic bucket upper bounds, one per power of two, plus +Inf"""
+    return [2.0**exponent for exponent in range(min_exponent, max_exponent + 1)] + [
+        INF
+    ]
+
+
+class NativeHistogram(NamedTuple):
+    """Point-in-time copy of one series, as read by the protobuf encoder"""
+
+    count: int
+    sum: float
+    schema: int
+    zero_threshold: float
+    zero_count: int
+    # NOTE: (index, count) sorted by index, empty buckets are not stored
+    buckets: Tuple[Tuple[int, int], ...]
+    exemplars: Tuple[Exemplar, ...]
+
+
+class ExponentialBuckets:
+    """Sparse base-2 exponential buckets of a native histogram.
+
+    Only buckets that received an observation are stored. Once there are more
+    than ``max_buckets`` the schema is decremented, which merges every pair of
+    neighbour buckets and halves the resolution, until the buckets fit again.
+    Not thread-safe, the owner serializes ``observe`` and reads.
+    """
+
+    __slots__ = (
+        "schema",
+        "max_buckets",
+        "zero_threshold",
+        "zero_count",
+        "count",
+        "sum",
+        "positive",
+    )
+
+    def __init__(
+        self,
+        schema: int = 3,
+        max_buckets: int = 160,
+        zero_threshold: float = ZERO_THRESHOLD,
+    ) -> None:
+        if not MIN_SCHEMA <= schema <= MAX_SCHEMA:
+            raise ValueError(f"schema must be in [{MIN_SCHEMA}, {MAX_SCHEMA}]")
+        if max_buckets < 1:
+            raise ValueError("max_buckets must be positive")
+        self.schema = schema
+        self.max_buckets = max_buckets
+        self.zero_threshold = zero_threshold
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.positive: Dict[int, int] = {}
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        if value <= self.zero_threshold:
+            self.zero_count += 1
+            return
+        positive = self.positive
+        index = bucket_index(value, self.schema)
+        positive[index] = positive.get(index, 0) + 1
+        while len(positive) > self.max_buckets and self.schema > MIN_SCHEMA:
+            self.reduce_resolution()
+            positive = self.positive
+
+    def reduce_resolution(self) -> None:
+        merged: Dict[int, int] = {}
+        for index, count in self.positive.items():
+            # NOTE: ceil(index / 2), bucket (base^(i-1), base^i] is in (base'^(j-1), base'^j]
+            index = (index + 1) >> 1
+            merged[index] = merged.get(index, 0) + count
+        self.positive = merged
+        self.schema -= 1
+
+    def cumulative_counts(self, min_exponent: int, max_exponent: int) -> List[int]:
+        """Down-sample to the classic ``exponential_bounds(min_exponent, max_exponent)``
+
+        Exact while ``schema >= 0``, the classic bounds are then bucket
+        boundaries too. Below that a bucket is counted under the first classic
+        bound at or above its upper bound.
+        """
+        counts = [0] * (max_exponent - min_exponent + 2)
+        counts[0] = self.zero_count
+        last = len(counts) - 1
+        schema = self.schema
+        for index, count in self.positive.items():
+            exponent = -((-index) >> schema) if schema >= 0 else index << -schema
+            slot = min(max(exponent - min_exponent, 0), last)
+            counts[slot] += count
+        total = 0
+        for slot, count in enumerate(counts):
+            total += count
+            counts[slot] = total
+        return counts
+
+
+class NativeHistogramMetric(Metric):
+    """Histogram family with the classic samples for the text formats and
+    the native buckets of each series for the protobuf format
+    """
+
+    def __init__(self, name: str, documentation: str, typ: str, unit: str = "") -> None:
+        super().__init__(name, documentation, typ, unit)
+        self.native: Dict[FrozenSet[Tuple[str, str]], NativeHistogram] = {}
+
+
+class ExponentialHistogram(MetricWrapperBase):
+    """Histogram with sparse exponential buckets, a drop-in for ``Histogram``.
+
+    Each series keeps ``ExponentialBuckets`` starting at ``schema`` (3 means
+    8 buckets per power of two, ~9% relative width) and bounded by
+    ``max_buckets``. It is exposed both as a native histogram (protobuf
+    exposition) and as classic buckets, one per power of two between
+    ``2^classic_exponents[0]`` and ``2^classic_exponents[1]`` seconds, for the
+    text formats. Exemplars are kept per classic bucket.
+
+    The buckets live in process memory, multiprocess mode is not supported.
+    """
+
+    _type = "histogram"
+    _reserved_labelnames = ["le"]
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        namespace: str = "",
+        subsystem: str = "",
+        unit: str = "",
+        registry: Optional[CollectorRegistry] = REGISTRY,
+        _labelvalues: Optional[Sequence[str]] = None,
+        schema: int = 3,
+        max_buckets: int = 160,
+        zero_threshold: float = ZERO_THRESHOLD,
+        classic_exponents: Tuple[int, int] = CLASSIC_EXPONENTS,
+    ) -> None:
+        # NOTE: set before super().__init__, it calls _metric_init for label-less metrics
+        self._schema = schema
+        self._max_buckets = max_buckets
+        self._zero_threshold = zero_threshold
+        self._classic_exponents = classic_exponents
+        self._upper_bounds = exponential_bounds(*classic_exponents)
+        self._le = [floatToGoString(bound) for bound in self._upper_bounds]
+        super().__init__(
+            name=name,
+            documentation=documentation,
+            labelnames=labelnames,
+            namespace=namespace,
+            subsystem=subsystem,
+            unit=unit,
+            registry=registry,
+            _labelvalues=_labelvalues,
+        )
+        self._kwargs.update(
+            schema=schema,
+            max_buckets=max_buckets,
+            zero_threshold=zero_threshold,
+            classic_exponents=classic_exponents,
+        )
+
+    def _metric_init(self) -> None:
+        self._observe_lock = threading.Lock()
+        self._buckets = ExponentialBuckets(
+            self._schema, self._max_buckets, self._zero_threshold
+        )
+        self._exemplars: List[Optional[Exemplar]] = [None] * len(self._upper_bounds)
+        self._created = time.time()
+
+    def observe(self, amount: float, exemplar: Optional[Dict[str, str]] = None) -> None:
+        self._raise_if_not_observable()
+        if exemplar:
+            _validate_exemplar(exemplar)
+        with self._observe_lock:
+            self._buckets.observe(amount)
+            if exemplar:
+                min_exponent, max_exponent = self._classic_exponents
+                slot = 0
+                if amount > self._zero_threshold:
+                    slot = min(
+                        max(bucket_index(amount, 0) - min_exponent, 0),
+                        max_exponent - min_exponent + 1,
+                    )
+                self._exemplars[slot] = Exemplar(exemplar, amount, time.time())
+
+    def _snapshot(self) -> Tuple[List[Sample], NativeHistogram]:
+        with self._observe_lock:
+            buckets = self._buckets
+            counts = buckets.cumulative_counts(*self._classic_exponents)
+            exemplars = list(self._exemplars)
+            native = NativeHistogram(
+                buckets.count,
+                buckets.sum,
+                buckets.schema,
+                buckets.zero_threshold,
+                buckets.zero_count,
+                tuple(sorted(buckets.positive.items())),
+                tuple(exemplar for exemplar in exemplars if exemplar is not None),
+            )
+        samples = [
+            Sample("_bucket", {"le": le}, float(count), None, exemplar)
+            for le, count, exemplar in zip(self._le, counts, exemplars)
+        ]
+        samples.append(Sample("_count", {}, float(native.count), None, None))
+        samples.append(Sample("_sum", {}, native.sum, None, None))
+        if _use_created:
+            samples.append(Sample("_created", {}, self._created, None, None))
+        return samples, native
+
+    def _child_samples(self) -> Iterable[Sample]:
+        return tuple(self._snapshot()[0])
+
+    def collect(self) -> Iterable[Metric]:
+        metric = NativeHistogramMetric(
+            self._name, self._documentation, self._type, self._unit
+        )
+        if self._is_parent():
+            with self._lock:
+                children = list(self._metrics.items())
+        else:
+            children = [((), self)]
+        for labelvalues, child in children:
+            labels = dict(zip(self._labelnames, labelvalues))
+            samples, native = child._snapshot()
+            for suffix, sample_labels, value, timestamp, exemplar in samples:
+                metric.add_sample(
+                    self._name + suffix,
+                    {**labels, **sample_labels},
+                    value,
+                    timestamp,
+                    exemplar,
+                )
+            metric.native[frozenset(labels.items())] = native
+        return [metric]
@@ -0,0 +1,166 @@
+import gzip
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from prometheus_client.metrics_core import Metric
+from prometheus_client.openmetrics.exposition import generate_latest
+
+from fastapi_app.core.protobuf_exposition import encode_family
+
+EOF = b"# EOF\n"
+IDENTITY = "identity"
+SUPPORTED_ENCODINGS = ("gzip", "deflate")
+OPENMETRICS = "openmetrics"
+PROTOBUF = "protobuf"
+PROTOBUF_MEDIA_TYPE = "application/vnd.google.protobuf"
+PROTOBUF_MESSAGE = "io.prometheus.client.metricfamily"
+
+
+class _SingleFamily:
+    """Registry-like wrapper to encode one metric family with generate_latest"""
+
+    __slots__ = ("metric",)
+
+    def __init__(self, metric: Metric) -> None:
+        self.metric = metric
+
+    def collect(self) -> List[Metric]:
+        return [self.metric]
+
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    """Pick gzip or deflate from an ``Accept-Encoding`` header, else identity"""
+    accepted: Dict[str, float] = {}
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip()] = quality
+
+    for coding in SUPPORTED_ENCODINGS:
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return IDENTITY
+
+
+def negotiate_format(accept: str) -> str:
+    """Pick the delimited protobuf format when the ``Accept`` header prefers it
+
+    Prometheus only asks for it (first) when native histograms are enabled.
+    """
+    best, best_quality = OPENMETRICS, 0.0
+    for item in accept.lower().split(","):
+        media_type, *params = (part.strip() for part in item.split(";"))
+        options = dict(param.partition("=")[::2] for param in params)
+        try:
+            quality = float(options.get("q", 1.0))
+        except ValueError:
+            quality = 0.0
+        if media_type == PROTOBUF_MEDIA_TYPE:
+            if (
+                options.get("proto") == PROTOBUF_MESSAGE
+                and options.get("encoding") == "delimited"
+                and quality > best_quality
+            ):
+                best, best_quality = PROTOBUF, quality
+        elif quality > best_quality:
+            best, best_quality = OPENMETRICS, quality
+    return best
+
+
+def encode_openmetrics(metric: Metric) -> bytes:
+    return generate_latest(_SingleFamily(metric))[: -len(EOF)]
+
+
+ENCODERS: Dict[str, Tuple[Callable[[Metric], bytes], bytes]] = {
+    OPENMETRICS: (encode_openmetrics, EOF),
+    PROTOBUF: (encode_family, b""),
+}
+
+
+def compress(data: bytes, encoding: str, level: int = 6) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=level)
+    if encoding == "deflate":
+        return zlib.compress(data, level)
+    return data
+
+
+class ExpositionCache:
+    """Cached exposition of a metric source.
+
+    - the payload is reused for ``max_age`` seconds, so several Prometheus
+      replicas and ad-hoc curls share one encoding
+    - on refresh only families whose samples changed are re-encoded
+    - each format (OpenMetrics text, protobuf) and compressed variant is
+      built once per refresh, on first request
+
+    ``get`` is blocking, call it from a thread (sync Starlette endpoints already
+    run in the threadpool). Concurrent callers wait for a single refresh.
+    """
+
+    def __init__(
+        self,
+        collect: Callable[[], Iterable[Metric]],
+        max_age: float = 1.0,
+        compress_level: int = 6,
+    ) -> None:
+        self.collect = collect
+        self.max_age = max_age
+        self.compress_level = compress_level
+        self._lock = threading.Lock()
+        self._metrics: Optional[List[Metric]] = None
+        self._families: Dict[str, Dict[str, Tuple[list, bytes]]] = {}
+        self._payloads: Dict[Tuple[str, str], bytes] = {}
+        self._generated_at = 0.0
+
+    def get(self, encoding: str = IDENTITY, fmt: str = OPENMETRICS) -> bytes:
+        with self._lock:
+            if (
+                self._metrics is None
+                or time.monotonic() - self._generated_at >= self.max_age
+            ):
+                self._refresh()
+            payload = self._payloads.get((fmt, encoding))
+            if payload is None:
+                identity = self._payloads.get((fmt, IDENTITY))
+                if identity is None:
+                    identity = self._payloads[(fmt, IDENTITY)] = self._encode(fmt)
+                payload = self._payloads[(fmt, encoding)] = compress(
+                    identity, encoding, self.compress_level
+                )
+            return payload
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._metrics = None
+            self._payloads = {}
+
+    def _refresh(self) -> None:
+        self._metrics = list(self.collect())
+        self._payloads = {}
+        self._generated_at = time.monotonic()
+
+    def _encode(self, fmt: str) -> bytes:
+        encode, footer = ENCODERS[fmt]
+        previous = self._families.get(fmt, {})
+        families: Dict[str, Tuple[list, bytes]] = {}
+        chunks: List[bytes] = []
+        for metric in self._metrics or ():
+            cached = previous.get(metric.name)
+            if cached is not None and cached[0] == metric.samples:
+                encoded = cached[1]
+            else:
+                encoded = encode(metric)
+            families[metric.name] = (metric.samples, encoded)
+            chunks.append(encoded)
+        chunks.append(footer)
+
+        self._families[fmt] = families
+        return b"".join(chunks)
@@ -1,13 +1,88 @@
 import contextvars
+import os
+import threading
 import types
+from typing import Optional
 
-request_global = contextvars.ContextVar(
-    "request_global", default=types.SimpleNamespace()
+from opentelemetry import trace
+
+# NOTE: one SimpleNamespace per request, set by UltimateLoggingMiddleware
+request_global: contextvars.ContextVar[Optional[types.SimpleNamespace]] = (
+    contextvars.ContextVar("request_global", default=None)
 )
 
 
+def current_request_global() -> Optional[types.SimpleNamespace]:
+    """Namespace of the current request, None outside a request.
+
+    Never set here: a namespace set outside the middleware, e.g. at startup,
+    would be inherited by every task created afterwards.
+    """
+    return request_global.get()
+
+
+class _RequestGlobals:
+    """Proxy to the namespace of the current request, ``g.trace_id`` etc."""
+
+    def __getattr__(self, name: str):
+        namespace = request_global.get()
+        if namespace is None:
+            raise AttributeError(name)
+        return getattr(namespace, name)
+
+    def __setattr__(self, name: str, value) -> None:
+        namespace = request_global.get()
+        if namespace is None:
+            raise RuntimeError(f"g.{name} can only be set inside a request")
+        setattr(namespace, name, value)
+
+
 # This is the only public API
-# def g():
-#     return request_global.get()
+g = _RequestGlobals()
+
+
+class IdPool:
+    """Random hex ids sliced from a pooled ``os.urandom`` buffer"""
+
+    def __init__(self, size: int = 16, pool_size: int = 4096) -> None:
+        self.size = size
+        self.pool_size = pool_size
+        self._pool = b""
+        self._position = 0
+        self._lock = threading.Lock()
+
+    def new(self) -> str:
+        with self._lock:
+            if self._position + self.size > len(self._pool):
+                self._pool = os.urandom(self.pool_size)
+                self._position = 0
+            chunk = self._pool[self._position : self._position + self.size]
+            self._position += self.size
+        return chunk.hex()
+
+
+TRACE_ID_POOL = IdPool()
+
+
+def get_trace_id() -> str:
+    """
+    trace id of the current request: an id set explicitly on the request,
+    else the active OpenTelemetry span, else one minted once per request.
+    Outside a request every call returns a new id.
+    """
+    namespace = request_global.get()
+    if namespace is not None:
+        trace_id = getattr(namespace, "trace_id", None)
+        if trace_id:
+            return trace_id
+
+    span_context = trace.get_current_span().get_span_context()
+    if span_context.is_valid:
+        return trace.format_trace_id(span_context.trace_id)
 
-g = request_global.get()
+    if namespace is None:
+        return TRACE_ID_POOL.new()
+    trace_id = getattr(namespace, "minted_trace_id", None)
+    if trace_id is None:
+        trace_id = namespace.minted_trace_id = TRACE_ID_POOL.new()
+    return trace_id
@@ -0,0 +1,236 @@
+import fcntl
+import glob
+import gzip
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+
+@contextmanager
+def locked(path: str) -> Iterator[None]:
+    """Serialize writes and rotation between processes writing to ``path``"""
+    with open(f"{path}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class SegmentCompressor:
+    """Background thread gzipping rotated log segments and pruning old ones"""
+
+    def __init__(self) -> None:
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, segment: str, compress: bool, base: str, backup_count: int):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="log-segment-compressor", daemon=True
+            )
+            self._thread.start()
+        self._queue.put((segment, compress, base, backup_count))
+
+    def join(self) -> None:
+        """Wait for every submitted segment"""
+        self._queue.join()
+
+    def _run(self) -> None:
+        while True:
+            segment, compress, base, backup_count = self._queue.get()
+            try:
+                if compress:
+                    self.compress(segment)
+                if backup_count:
+                    self.prune(base, backup_count)
+            except OSError:
+                logging.getLogger(__name__).exception("cannot compress %s", segment)
+            finally:
+                self._queue.task_done()
+
+    @staticmethod
+    def compress(segment: str) -> None:
+        target = f"{segment}.gz"
+        with open(segment, "rb") as source, gzip.open(f"{target}.tmp", "wb") as out:
+            shutil.copyfileobj(source, out, 1024 * 1024)
+        os.replace(f"{target}.tmp", target)
+        os.remove(segment)
+
+    @staticmethod
+    def prune(base: str, backup_count: int) -> None:
+        segments = [
+            path for path in glob.glob(f"{base}.*-*") if not path.endswith(".tmp")
+        ]
+        segments.sort(key=os.path.basename)
+        for path in segments[:-backup_count]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # NOTE: pruned by another worker
+                pass
+
+
+SEGMENT_COMPRESSOR = SegmentCompressor()
+
+
+class JSONLinesFileHandler(logging.Handler):
+    """File sink writing one JSON document per line with group commit.
+
+    ``emit`` only formats the record and appends it to a buffer, a flusher
+    thread writes the buffer with a single ``os.write`` once it holds
+    ``buffer_bytes`` or every ``flush_interval`` seconds. The file is opened
+    with ``O_APPEND`` so batches of several worker processes never interleave.
+
+    The file rotates when it reaches ``max_bytes`` and/or when a new
+    ``rotate_seconds`` period starts (aligned to the epoch, so ``86400``
+    rotates at UTC midnight). Each batch is written under a file lock, taken
+    before checking the inode. Rotation renames the file to
+    ``<filename>.<timestamp>-<pid>`` under that lock; other workers notice
+    the new inode on their next flush and reopen. Rotated segments are
+    gzipped and pruned to ``backup_count`` in a background thread.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        max_bytes: int = 10 * 1024 * 1024,
+        rotate_seconds: int = 0,
+        backup_count: int = 30,
+        compress: bool = True,
+        buffer_bytes: int = 64 * 1024,
+        flush_interval: float = 1.0,
+        level: int = logging.NOTSET,
+    ) -> None:
+        super().__init__(level)
+        self.filename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.backup_count = backup_count
+        self.compress = compress
+        self.buffer_bytes = buffer_bytes
+        self.flush_interval = flush_interval
+        self._buffer: List[bytes] = []
+        self._buffered = 0
+        self._buffer_lock = threading.Lock()
+        # NOTE: held while writing, emit never waits for it unless the buffer
+        # has grown to 4 times buffer_bytes
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._fd = -1
+        self._open()
+        self._flusher = threading.Thread(
+            target=self._run, name="log-file-flusher", daemon=True
+        )
+        self._flusher.start()
+
+    def _open(self) -> None:
+        self._fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._period = self._current_period()
+
+    def _current_period(self) -> int:
+        return int(time.time() // self.rotate_seconds) if self.rotate_seconds else 0
+
+    def format_bytes(self, record: logging.LogRecord) -> bytes:
+        formatter = self.formatter
+        if formatter is not None and hasattr(formatter, "format_bytes"):
+            return formatter.format_bytes(record) + b"\n"
+        return (self.format(record) + "\n").encode("utf-8")
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            line = self.format_bytes(record)
+        except Exception:
+            self.handleError(record)
+            return
+        with self._buffer_lock:
+            self._buffer.append(line)
+            self._buffered += len(line)
+            buffered = self._buffered
+        if buffered >= self.buffer_bytes:
+            if buffered >= 4 * self.buffer_bytes:
+                # NOTE: the flusher cannot keep up, write from this thread
+                self.flush()
+            else:
+                self._wakeup.set()
+
+    def flush(self) -> None:
+        with self._write_lock:
+            with self._buffer_lock:
+                lines, self._buffer, self._buffered = self._buffer, [], 0
+            if lines and self._fd >= 0:
+                self._write(b"".join(lines))
+
+    def _write(self, data: bytes) -> None:
+        """Write lock must be held by caller."""
+        # NOTE: the file lock is held from the inode check to the write, a
+        # segment renamed by another worker may be gzipped and removed at once
+        with locked(self.filename):
+            self._reopen_if_rotated()
+            segment = None
+            if self._should_rotate(len(data)):
+                segment = self._rotate()
+            view = memoryview(data)
+            while view:
+                written = os.write(self._fd, view)
+                view = view[written:]
+        if segment is not None:
+            SEGMENT_COMPRESSOR.submit(
+                segment, self.compress, self.filename, self.backup_count
+            )
+
+    def _reopen_if_rotated(self) -> None:
+        try:
+            current = os.stat(self.filename).st_ino
+        except FileNotFoundError:
+            current = None
+        if current != os.fstat(self._fd).st_ino:
+            os.close(self._fd)
+            self._open()
+
+    def _should_rotate(self, incoming: int) -> bool:
+        if self.rotate_seconds and self._current_period() != self._period:
+            return True
+        if not self.max_bytes:
+            return False
+        size = os.fstat(self._fd).st_size
+        return size > 0 and size + incoming > self.max_bytes
+
+    def _rotate(self) -> Optional[str]:
+        """File lock must be held by caller, returns the renamed segment."""
+        if not os.fstat(self._fd).st_size:
+            self._period = self._current_period()
+            return None
+        stamp = datetime.now().strftime("%Y%m%dT%H%M%S%f")
+        segment = f"{self.filename}.{stamp}-{os.getpid()}"
+        os.rename(self.filename, segment)
+        os.close(self._fd)
+        self._open()
+        return segment
+
+    def _run(self) -> None:
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except OSError:
+                logging.getLogger(__name__).exception("cannot write %s", self.filename)
+
+    def close(self) -> None:
+        if not self._stopping:
+            self._stopping = True
+            self._wakeup.set()
+            self._flusher.join()
+            self.flush()
+            with self._write_lock:
+                os.close(self._fd)
+                self._fd = -1
+        super().close()
@@ -0,0 +1,104 @@
+import logging
+import random
+from typing import Mapping, Optional
+
+from opentelemetry import trace
+
+from fastapi_app.core.parsing import parse_rates
+from fastapi_app.core.settings import settings
+
+TRACE_ID_LOW_BITS = 0xFFFFFFFFFFFFFFFF
+
+
+class LogSampler:
+    """Decide whether a log record is kept, before any JSON is built.
+
+    Records are always kept (weight 1) for errors, 5xx responses, requests
+    slower than ``slow_threshold_ms`` and, with ``keep_sampled_traces``, traces
+    sampled by the tracer provider. Otherwise the rate of the route, else of
+    the level, else ``default_rate`` applies and kept records carry the weight
+    ``1 / rate`` so dashboards can scale counts back up. The decision uses the
+    trace id when there is one, so every service keeps the same traces.
+    """
+
+    def __init__(
+        self,
+        default_rate: float = 1.0,
+        route_rates: Optional[Mapping[str, float]] = None,
+        level_rates: Optional[Mapping[str, float]] = None,
+        slow_threshold_ms: int = 1000,
+        keep_sampled_traces: bool = True,
+    ) -> None:
+        self.default_rate = default_rate
+        self.route_rates = dict(route_rates or {})
+        self.level_rates = {
+            logging.getLevelName(name.upper()): rate
+            for name, rate in (level_rates or {}).items()
+        }
+        self.slow_threshold_ms = slow_threshold_ms
+        self.keep_sampled_traces = keep_sampled_traces
+
+    def weight(
+        self,
+        level: int,
+        route: Optional[str] = None,
+        status_code: int = 0,
+        duration: int = 0,
+    ) -> float:
+        """Sample weight of a record, 0 means drop it"""
+        if level >= logging.ERROR or status_code >= 500:
+            return 1.0
+        if self.slow_threshold_ms and duration >= self.slow_threshold_ms:
+            return 1.0
+
+        span_context = trace.get_current_span().get_span_context()
+        if self.keep_sampled_traces and span_context.trace_flags.sampled:
+            return 1.0
+
+        rate = self.route_rates.get(route)
+        if rate is None:
+            rate = self.level_rates.get(level, self.default_rate)
+        if rate >= 1.0:
+            return 1.0
+        if rate <= 0.0:
+            return 0.0
+
+        if span_context.is_valid:
+            keep = (span_context.trace_id & TRACE_ID_LOW_BITS) < rate * (
+                TRACE_ID_LOW_BITS + 1
+            )
+        else:
+            keep = random.random() < rate
+        return 1.0 / rate if keep else 0.0
+
+
+class LogSamplingFilter(logging.Filter):
+    """Logger filter applying the level rates to records of the loggers it is attached to.
+    Records that already carry a ``sample_weight`` (access logs) pass through.
+    """
+
+    def __init__(self, sampler: LogSampler) -> None:
+        super().__init__()
+        self.sampler = sampler
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if hasattr(record, "sample_weight"):
+            return True
+        weight = self.sampler.weight(record.levelno)
+        if not weight:
+            return False
+        record.sample_weight = weight
+        return True
+
+
+LOG_SAMPLER = (
+    LogSampler(
+        default_rate=settings.LOG_SAMPLE_RATE,
+        route_rates=parse_rates(settings.LOG_SAMPLE_ROUTE_RATES),
+        level_rates=parse_rates(settings.LOG_SAMPLE_LEVEL_RATES),
+        slow_threshold_ms=settings.LOG_SAMPLE_SLOW_MS,
+        keep_sampled_traces=settings.LOG_SAMPLE_KEEP_TRACES,
+    )
+    if settings.LOG_SAMPLING
+    else None
+)
@@ -1,33 +1,117 @@
 import logging
 import os
 import sys
-from types import FrameType
-from typing import cast
+import threading
+from typing import Dict, Optional, Tuple, Union
 
-import loguru
 import uvicorn
 
 from fastapi_app.core.logging_constant import LOG_FILE_PATH, LOG_HANDLER, LOGGING_LEVEL
-from fastapi_app.core.logging_formatter import ColoredJSONLogFormatter, JSONLogFormatter
+from fastapi_app.core.logging_formatter import (
+    ColoredJSONLogFormatter,
+    FastJSONLogFormatter,
+    JSONLogFormatter,
+)
 from fastapi_app.core.settings import settings
 
 
 class ConsoleLogger(logging.Handler):
+    """Bridge stdlib records to loguru.
+
+    The caller (module, function, line, file) comes from the LogRecord
+    itself, cached per callsite, instead of walking the stack on every
+    record, so it stays right when records are emitted from the async log
+    queue thread. Level names are mapped once per level. With ``enqueue``
+    loguru's sinks are written from its own thread (``LOG_LOGURU_ENQUEUE``).
+    loguru is imported on the first record.
+    """
+
+    def __init__(self, level: int = logging.NOTSET, enqueue: bool = False) -> None:
+        super().__init__(level)
+        self.enqueue = enqueue
+        self.levels: Dict[Tuple[str, int], Union[str, int]] = {}
+        self.callsites: Dict[Tuple[str, int, str], dict] = {}
+        self.modules: Dict[str, Optional[str]] = {}
+        self.local = threading.local()
+        self.logger = None
+
+    def setup(self) -> None:
+        import loguru
+
+        if self.enqueue:
+            enable_loguru_enqueue()
+        self.logger = loguru.logger.patch(self.patch)
+
     def emit(self, record: logging.LogRecord) -> None:  # pragma: no cover
+        if self.logger is None:
+            self.setup()
         # Get corresponding Loguru level if it exists
+        key = (record.levelname, record.levelno)
+        level = self.levels.get(key)
+        if level is None:
+            try:
+                level = self.logger.level(record.levelname).name
+            except ValueError:
+                level = record.levelno
+            self.levels[key] = level
+
+        self.local.record = record
         try:
-            level = loguru.logger.level(record.levelname).name
-        except ValueError:
-            level = str(record.levelno)
-        # Find caller from where originated the logged message
-        frame, depth = logging.currentframe(), 2
-        while frame.f_code.co_filename == logging.__file__:  # noqa: WPS609
-            frame = cast(FrameType, frame.f_back)
-            depth += 1
-        loguru.logger.opt(depth=depth, exception=record.exc_info).log(
-            level,
-            record.getMessage(),
-        )
+            logger = self.logger
+            if record.exc_info:
+                logger = logger.opt(exception=record.exc_info)
+            logger.log(level, record.getMessage())
+        finally:
+            self.local.record = None
+
+    def patch(self, loguru_record: dict) -> None:
+        record = self.local.record
+        if record is not None:
+            # NOTE: loguru builds a new file attribute per record, only its
+            # public name and path are replaced
+            loguru_record["file"].name = record.filename
+            loguru_record["file"].path = record.pathname
+            loguru_record.update(self.callsite(record))
+
+    def callsite(self, record: logging.LogRecord) -> dict:
+        key = (record.pathname, record.lineno, record.funcName)
+        callsite = self.callsites.get(key)
+        if callsite is None:
+            callsite = self.callsites[key] = {
+                "function": record.funcName,
+                "line": record.lineno,
+                "module": record.module,
+                "name": self.module_name(record.pathname),
+            }
+        return callsite
+
+    def module_name(self, pathname: str) -> Optional[str]:
+        """``__name__`` of the module at ``pathname``, like loguru's record name"""
+        if pathname not in self.modules:
+            self.modules[pathname] = next(
+                (
+                    name
+                    for name, module in list(sys.modules.items())
+                    if getattr(module, "__file__", None) == pathname
+                ),
+                None,
+            )
+        return self.modules[pathname]
+
+
+def enable_loguru_enqueue() -> None:
+    """Re-add loguru's default stderr sink with ``enqueue=True``
+
+    Only the default handler (id 0) is replaced, sinks added by the
+    application are kept. Nothing is added when it was removed already.
+    """
+    import loguru
+
+    try:
+        loguru.logger.remove(0)
+    except ValueError:
+        return
+    loguru.logger.add(sys.stderr, enqueue=True)
 
 
 LOG_CONFIG = {
@@ -40,6 +124,10 @@ LOG_CONFIG = {
         "json": {
             "()": JSONLogFormatter,
         },
+        "fast_json": {
+            "()": FastJSONLogFormatter,
+            "backend": settings.LOG_FAST_JSON_BACKEND,
+        },
         "colored": {
             "()": "colorlog.ColoredFormatter",
             "format": "%(log_color)s%(levelname)-8s%(reset)s %(blue)s%(message)s",
@@ -55,6 +143,7 @@ LOG_CONFIG = {
         },
         "intercept": {
             "()": ConsoleLogger,
+            "enqueue": settings.LOG_LOGURU_ENQUEUE,
         },
         "file_handler": {
             "level": "INFO",
@@ -73,7 +162,7 @@ LOG_CONFIG = {
             # NOTE: RotatingFileHandler #
             "filename": LOG_FILE_PATH,
             "class": "logging.handlers.RotatingFileHandler",
-            "formatter": "json",
+            "formatter": "fast_json" if settings.LOG_FAST_JSON else "json",
             "maxBytes": 10485760,  # 10MB
             "backupCount": 30,
         },
@@ -97,6 +186,33 @@ LOG_CONFIG = {
     },
 }
 
+if settings.LOG_FILE_SINK:
+    # NOTE: JSON lines with group commit, size/time rotation and gzip; by
+    # dotted path, dictConfig imports it only when configured
+    LOG_CONFIG["handlers"]["file_handler"] = {
+        "level": "INFO",
+        "()": "fastapi_app.core.log_file_sink.JSONLinesFileHandler",
+        "filename": LOG_FILE_PATH,
+        "formatter": "fast_json" if settings.LOG_FAST_JSON else "json",
+        "max_bytes": 10485760,  # 10MB
+        "rotate_seconds": settings.LOG_FILE_ROTATE_SECONDS,
+        "backup_count": 30,
+        "compress": settings.LOG_FILE_COMPRESS,
+    }
+
+if settings.LOG_LOKI_URL:
+    # NOTE: batched push, streams labeled by app_name, env and level; by
+    # dotted path, so httpx is imported only when configured
+    LOG_CONFIG["handlers"]["loki"] = {
+        "level": "INFO",
+        "()": "fastapi_app.core.loki_handler.LokiHandler",
+        "url": settings.LOG_LOKI_URL,
+        "formatter": "fast_json" if settings.LOG_FAST_JSON else "json",
+        "labels": {"app_name": settings.PROJECT_NAME, "env": settings.ENVIRONMENT},
+    }
+    for logger_config in LOG_CONFIG["loggers"].values():
+        logger_config["handlers"] = [*logger_config["handlers"], "loki"]
+
 log_config = uvicorn.config.LOGGING_CONFIG
 
 if (
@@ -51,3 +51,17 @@ PASS_ROUTES = [
     f"/api/{settings.API_VERSION}/redoc",
     f"/api/{settings.API_VERSION}/healthcheck",
 ]
+# NOTE: max bytes of response body kept for the log by content type prefix,
+# other (binary) content types only log their size
+RESPONSE_BODY_LIMITS = {
+    "application/json": 4096,
+    "application/problem+json": 4096,
+    "text/": 1024,
+}
+# NOTE: max bytes of request body prefix kept for the log by content type
+# prefix, multipart uploads and other content types are never buffered
+REQUEST_BODY_LIMITS = {
+    "application/json": 2048,
+    "application/x-www-form-urlencoded": 1024,
+    "text/": 1024,
+}
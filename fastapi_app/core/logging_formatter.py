@@ -1,16 +1,22 @@
 import json
 import logging
-import uuid
 from datetime import datetime
+from json.encoder import encode_basestring
 
-import stackprinter
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 
-from fastapi_app.core.globals import g
+from fastapi_app.core.exception_render import render_exception
+from fastapi_app.core.globals import get_trace_id
 from fastapi_app.core.logging_constant import COLORS, LEVEL_TO_NAME
 from fastapi_app.core.logging_schema import BaseJSONLogSchema
 from fastapi_app.core.settings import settings
 from fastapi_app.utils import is_ip_start
 
+BASE_LOG_KEYS = frozenset(BaseJSONLogSchema.model_fields) | {"props"}
+
 
 class ColoredJSONLogFormatter(logging.Formatter):
     """
@@ -41,11 +47,8 @@ class ColoredJSONLogFormatter(logging.Formatter):
         )
         message = record.getMessage()
         duration = record.duration if hasattr(record, "duration") else record.msecs
-        if hasattr(g, "trace_id"):
-            trace_id = g.trace_id
-        else:
-            trace_id = str(uuid.uuid4().hex)
-            g.trace_id = trace_id
+        # NOTE: set by the async log queue, formatting runs in another thread
+        trace_id = getattr(record, "trace_id", None) or get_trace_id()
         json_log_fields = BaseJSONLogSchema(
             trace_id=trace_id,
             thread=record.process,
@@ -66,20 +69,18 @@ class ColoredJSONLogFormatter(logging.Formatter):
             json_log_fields.exceptions = (
                 # default library traceback
                 # traceback.format_exception(*record.exc_info)
-                # stackprinter gets all debug information
+                # stackprinter gets all debug information, rendered once per
+                # fingerprint and window, repeats only log a summary
                 # https://github.com/cknd/stackprinter/blob/master/stackprinter/__init__.py#L28-L137
-                stackprinter.format(
-                    record.exc_info,
-                    suppressed_paths=[
-                        r"lib/python.*/site-packages/starlette.*",
-                    ],
-                    add_summary=False,
-                ).split("\n")
+                render_exception(record)
             )
 
         elif record.exc_text:
             json_log_fields.exceptions = record.exc_text
 
+        if hasattr(record, "sample_weight"):
+            json_log_fields.sample_weight = record.sample_weight
+
         # Pydantic to dict
         json_log_object = json_log_fields.model_dump(
             exclude_unset=True,
@@ -121,11 +122,8 @@ class JSONLogFormatter(logging.Formatter):
         else:
             msg = message
         duration = record.duration if hasattr(record, "duration") else record.msecs
-        if hasattr(g, "trace_id"):
-            trace_id = g.trace_id
-        else:
-            trace_id = str(uuid.uuid4().hex)
-            g.trace_id = trace_id
+        # NOTE: set by the async log queue, formatting runs in another thread
+        trace_id = getattr(record, "trace_id", None) or get_trace_id()
         json_log_fields = BaseJSONLogSchema(
             trace_id=trace_id,
             thread=record.process,
@@ -146,20 +144,18 @@ class JSONLogFormatter(logging.Formatter):
             json_log_fields.exceptions = (
                 # default library traceback
                 # traceback.format_exception(*record.exc_info)
-                # stackprinter gets all debug information
+                # stackprinter gets all debug information, rendered once per
+                # fingerprint and window, repeats only log a summary
                 # https://github.com/cknd/stackprinter/blob/master/stackprinter/__init__.py#L28-L137
-                stackprinter.format(
-                    record.exc_info,
-                    suppressed_paths=[
-                        r"lib/python.*/site-packages/starlette.*",
-                    ],
-                    add_summary=False,
-                ).split("\n")
+                render_exception(record)
             )
 
         elif record.exc_text:
             json_log_fields.exceptions = record.exc_text
 
+        if hasattr(record, "sample_weight"):
+            json_log_fields.sample_weight = record.sample_weight
+
         # Pydantic to dict
         json_log_object = json_log_fields.model_dump(
             exclude_unset=True,
@@ -170,3 +166,131 @@ class JSONLogFormatter(logging.Formatter):
             json_log_object.update(record.request_json_fields)
 
         return json_log_object
+
+
+class FastJSONLogFormatter(logging.Formatter):
+    """
+    high-throughput variant of JSONLogFormatter without per-record Pydantic models
+
+    - app_name, app_version and app_env are encoded once
+    - the timestamp string is cached per second
+    - the default ``json`` backend writes lines byte-identical to
+      JSONLogFormatter; ``orjson`` (opt-in, needs orjson installed) is faster
+      but not byte-compatible: same document, compact separators
+    """
+
+    def __init__(self, *args, backend: str = "json", **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        if backend not in ("json", "orjson"):
+            raise ValueError("backend must be json or orjson")
+        if backend == "orjson" and orjson is None:
+            raise ValueError("the orjson backend needs orjson installed")
+        self.backend = backend
+        self._static = {
+            "app_name": settings.PROJECT_NAME,
+            "app_version": settings.API_VERSION,
+            "app_env": settings.ENVIRONMENT,
+        }
+        # NOTE: fields between "timestamp" and "duration" in BaseJSONLogSchema
+        self._static_json = "".join(
+            f', "{key}": {encode_basestring(value)}'
+            for key, value in self._static.items()
+        )
+        # NOTE: (second, timestamp) in one attribute, records may be formatted
+        # by several threads (e.g. the async log listener)
+        self._timestamp = (None, "")
+
+    def format(self, record: logging.LogRecord, *args, **kwargs) -> str:
+        return self.format_bytes(record).decode("utf-8")
+
+    def format_bytes(self, record: logging.LogRecord) -> bytes:
+        if self.backend == "orjson":
+            return orjson.dumps(self._format_log_object(record))
+        return self._format_json(record).encode("utf-8")
+
+    def _now(self, created: float) -> str:
+        second = int(created)
+        cached_second, timestamp = self._timestamp
+        if second != cached_second:
+            timestamp = datetime.fromtimestamp(second).astimezone().isoformat()
+            self._timestamp = (second, timestamp)
+        return timestamp
+
+    @staticmethod
+    def _trace_id(record: logging.LogRecord) -> str:
+        return getattr(record, "trace_id", None) or get_trace_id()
+
+    @staticmethod
+    def _message(record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        return "" if is_ip_start(message) else message
+
+    @staticmethod
+    def _exceptions(record: logging.LogRecord):
+        if record.exc_info:
+            return render_exception(record)
+        return record.exc_text
+
+    def _format_log_object(self, record: logging.LogRecord) -> dict:
+        log_object = {
+            "trace_id": self._trace_id(record),
+            "thread": record.process,
+            "level_name": LEVEL_TO_NAME[record.levelno],
+            "message": self._message(record),
+            "source_log": record.name,
+            "timestamp": self._now(record.created),
+            **self._static,
+            "duration": int(getattr(record, "duration", record.msecs)),
+        }
+        exceptions = self._exceptions(record)
+        if exceptions:
+            log_object["exceptions"] = exceptions
+        if hasattr(record, "sample_weight"):
+            log_object["sample_weight"] = record.sample_weight
+        if hasattr(record, "props"):
+            log_object["props"] = record.props
+        if hasattr(record, "request_json_fields"):
+            log_object.update(record.request_json_fields)
+        return log_object
+
+    def _format_json(self, record: logging.LogRecord) -> str:
+        extra: dict = getattr(record, "request_json_fields", None) or {}
+        if not BASE_LOG_KEYS.isdisjoint(extra.keys() - {"duration"}):
+            # NOTE: rare overrides of base fields keep their position like dict.update
+            return json.dumps(self._format_log_object(record), ensure_ascii=False)
+        duration = extra.get(
+            "duration", int(getattr(record, "duration", record.msecs))
+        )
+        parts = [
+            '{"trace_id": ',
+            encode_basestring(self._trace_id(record)),
+            f', "thread": {record.process}, "level_name": "',
+            LEVEL_TO_NAME[record.levelno],
+            '", "message": ',
+            encode_basestring(self._message(record)),
+            ', "source_log": ',
+            encode_basestring(record.name),
+            ', "timestamp": "',
+            self._now(record.created),
+            '"',
+            self._static_json,
+            ', "duration": ',
+            json.dumps(duration),
+        ]
+        exceptions = self._exceptions(record)
+        if exceptions:
+            parts += [', "exceptions": ', json.dumps(exceptions, ensure_ascii=False)]
+        if hasattr(record, "sample_weight"):
+            parts += [', "sample_weight": ', json.dumps(record.sample_weight)]
+        if hasattr(record, "props"):
+            parts += [', "props": ', json.dumps(record.props, ensure_ascii=False)]
+
+        rest = {
+            key: value
+            for key, value in extra.items()
+            if key not in BASE_LOG_KEYS
+        }
+        if rest:
+            parts += [", ", json.dumps(rest, ensure_ascii=False)[1:-1]]
+        parts.append("}")
+        return "".join(parts)
@@ -0,0 +1,222 @@
+import atexit
+import logging
+import threading
+from collections import deque
+from typing import Deque, Iterable, List, Optional, Sequence, Tuple
+
+from prometheus_client import Counter, Gauge
+
+from fastapi_app.core.globals import get_trace_id
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_DEBUG_FIRST = "drop-debug-first"
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_DEBUG_FIRST, OVERFLOW_DROP_OLDEST)
+
+LOG_QUEUE_DEPTH = Gauge(
+    "fastapi_log_queue_depth",
+    "Number of log records waiting for the log listener thread",
+    multiprocess_mode="livesum",
+)
+LOG_RECORDS_DROPPED = Counter(
+    "fastapi_log_records_dropped_total",
+    "Total count of log records dropped by the log queue by level",
+    ["level"],
+)
+
+QueueItem = Tuple[Sequence[logging.Handler], logging.LogRecord]
+
+
+class LogQueue:
+    """Bounded queue of log records with a configurable overflow policy
+
+    - ``block``: the producer waits for the listener to make room
+    - ``drop-debug-first``: drop DEBUG records (incoming or queued) first,
+      then the oldest record
+    - ``drop-oldest``: drop the oldest queued record
+
+    Once closed, ``put`` refuses records so the caller handles them itself.
+    """
+
+    def __init__(self, maxsize: int = 10000, overflow: str = OVERFLOW_DROP_OLDEST):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}")
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self._items: Deque[QueueItem] = deque()
+        self._debug_count = 0
+        self._cond = threading.Condition()
+        self.closed = False
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def put(self, item: QueueItem) -> bool:
+        record = item[1]
+        with self._cond:
+            if self.closed:
+                return False
+            if len(self._items) >= self.maxsize:
+                if self.overflow == OVERFLOW_BLOCK:
+                    while len(self._items) >= self.maxsize and not self.closed:
+                        self._cond.wait()
+                    if self.closed:
+                        return False
+                elif self.overflow == OVERFLOW_DROP_DEBUG_FIRST and (
+                    record.levelno <= logging.DEBUG
+                ):
+                    self._drop(record)
+                    return True
+                else:
+                    self._evict()
+            self._items.append(item)
+            if record.levelno <= logging.DEBUG:
+                self._debug_count += 1
+            # NOTE: set rather than read at scrape time, so it reaches the
+            # multiprocess files
+            LOG_QUEUE_DEPTH.set(len(self._items))
+            self._cond.notify_all()
+            return True
+
+    def get_batch(self, size: int, timeout: Optional[float] = None) -> List[QueueItem]:
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+            batch = []
+            while self._items and len(batch) < size:
+                item = self._items.popleft()
+                if item[1].levelno <= logging.DEBUG:
+                    self._debug_count -= 1
+                batch.append(item)
+            if batch:
+                LOG_QUEUE_DEPTH.set(len(self._items))
+                self._cond.notify_all()
+            return batch
+
+    def close(self) -> None:
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def _evict(self) -> None:
+        """Make room for one record. Lock must be held by caller."""
+        index = 0
+        if self.overflow == OVERFLOW_DROP_DEBUG_FIRST and self._debug_count:
+            index = next(
+                i
+                for i, (_, queued) in enumerate(self._items)
+                if queued.levelno <= logging.DEBUG
+            )
+        record = self._items[index][1]
+        del self._items[index]
+        if record.levelno <= logging.DEBUG:
+            self._debug_count -= 1
+        self._drop(record)
+
+    @staticmethod
+    def _drop(record: logging.LogRecord) -> None:
+        LOG_RECORDS_DROPPED.labels(level=record.levelname).inc()
+
+
+class QueueingHandler(logging.Handler):
+    """Puts records into a LogQueue instead of formatting and writing them"""
+
+    def __init__(self, queue: LogQueue, targets: Sequence[logging.Handler]) -> None:
+        super().__init__()
+        self.queue = queue
+        self.targets = tuple(targets)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # NOTE: merge args now, the listener formats later in another thread;
+        # exc_info is kept for the JSON formatters' stackprinter output
+        record.msg = record.getMessage()
+        record.args = None
+        # NOTE: the request context is not visible from the listener thread
+        if not hasattr(record, "trace_id"):
+            record.trace_id = get_trace_id()
+        return record
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            item = (self.targets, self.prepare(record))
+            if not self.queue.put(item):
+                # NOTE: the listener is stopped, write from this thread
+                BatchQueueListener.handle((item,))
+        except Exception:
+            self.handleError(record)
+
+
+class BatchQueueListener:
+    """Thread draining a LogQueue in batches into the original handlers"""
+
+    def __init__(
+        self, queue: LogQueue, batch_size: int = 256, flush_interval: float = 0.5
+    ) -> None:
+        self.queue = queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="log-queue-listener", daemon=True
+        )
+        self._thread.start()
+
+    def setup(self, app) -> None:
+        app.add_event_handler("shutdown", self.stop)
+
+    def stop(self) -> None:
+        """Flush every queued record and stop the thread, later records are
+        written by the thread logging them"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self.queue.close()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            batch = self.queue.get_batch(self.batch_size, self.flush_interval)
+            if batch:
+                self.handle(batch)
+            elif self._stopping.is_set():
+                return
+
+    @staticmethod
+    def handle(batch: Iterable[QueueItem]) -> None:
+        touched = set()
+        for targets, record in batch:
+            for handler in targets:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+                    touched.add(handler)
+        for handler in touched:
+            handler.flush()
+
+
+def enable_async_logging(
+    logger_names: Iterable[str],
+    maxsize: int = 10000,
+    overflow: str = OVERFLOW_DROP_OLDEST,
+    batch_size: int = 256,
+) -> BatchQueueListener:
+    """
+    Swap the handlers of ``logger_names`` for one QueueingHandler per logger,
+    so formatting and disk I/O happen in the listener thread instead of the
+    event loop. ``setup(app)`` on the returned listener flushes the queue on
+    application shutdown, interpreter exit remains a fallback.
+    """
+    queue = LogQueue(maxsize, overflow)
+    for name in logger_names:
+        logger = logging.getLogger(name)
+        if logger.handlers:
+            logger.handlers = [QueueingHandler(queue, logger.handlers)]
+
+    listener = BatchQueueListener(queue, batch_size)
+    listener.start()
+    # NOTE: when the app lifespan never ran
+    atexit.register(listener.stop)
+    return listener
@@ -21,6 +21,7 @@ class BaseJSONLogSchema(BaseModel):
     exceptions: Union[List[str], str] = None
     span_id: str = None
     parent_id: str = None
+    sample_weight: float = None
 
     class Config:
         # 'allow_population_by_field_name' has been renamed to 'populate_by_name'
@@ -42,11 +43,13 @@ class RequestJSONLogSchema(BaseModel):
     request_content_type: str
     request_headers: dict
     request_body: Optional[str] = None
+    request_body_truncated: bool = False
     request_direction: str
     response_status_code: int
     response_size: int
     response_headers: dict
     response_body: Optional[str] = None
+    response_body_truncated: bool = False
     duration: int
 
     # @field_validator("request_body")
@@ -0,0 +1,172 @@
+import gzip
+import json
+import logging
+import random
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Mapping, Optional, Tuple
+
+import httpx
+from prometheus_client import Counter
+
+from fastapi_app.core.logging_constant import LEVEL_TO_NAME
+
+LOKI_RECORDS_SENT = Counter(
+    "fastapi_loki_records_sent_total",
+    "Total count of log records pushed to Loki",
+)
+LOKI_RECORDS_DROPPED = Counter(
+    "fastapi_loki_records_dropped_total",
+    "Total count of log records dropped by the Loki handler by reason",
+    ["reason"],
+)
+LOKI_PUSH_FAILURES = Counter(
+    "fastapi_loki_push_failures_total",
+    "Total count of failed Loki push requests (retries included)",
+)
+
+# NOTE: (level label, timestamp in ns, line)
+Entry = Tuple[str, str, str]
+
+
+class LokiHandler(logging.Handler):
+    """Push formatted records to Loki's push API in batches.
+
+    ``emit`` appends the formatted line to a bounded buffer (the oldest
+    records are dropped once it holds ``max_buffer``), a sender thread pushes
+    up to ``batch_size`` records every ``flush_interval`` seconds, or as soon
+    as a batch is full. Streams are grouped by the static ``labels`` (e.g.
+    app_name, env) plus the record level, payloads are gzipped JSON.
+    Connection errors, 429 and 5xx are retried with exponential backoff and
+    jitter up to ``max_retries`` times, records keep buffering meanwhile.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        labels: Optional[Mapping[str, str]] = None,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        max_buffer: int = 10000,
+        max_retries: int = 5,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        timeout: float = 5.0,
+        compress: bool = True,
+        tenant_id: Optional[str] = None,
+        level: int = logging.NOTSET,
+    ) -> None:
+        super().__init__(level)
+        self.url = url
+        self.labels = dict(labels or {})
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.compress = compress
+        headers = {"Content-Type": "application/json"}
+        if compress:
+            headers["Content-Encoding"] = "gzip"
+        if tenant_id:
+            headers["X-Scope-OrgID"] = tenant_id
+        self.client = httpx.Client(headers=headers, timeout=timeout)
+        self._buffer: Deque[Entry] = deque()
+        self._buffer_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._sender = threading.Thread(
+            target=self._run, name="loki-sender", daemon=True
+        )
+        self._sender.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            entry = (
+                LEVEL_TO_NAME.get(record.levelno, record.levelname),
+                str(int(record.created * 1e9)),
+                self.format(record),
+            )
+        except Exception:
+            self.handleError(record)
+            return
+        with self._buffer_lock:
+            if len(self._buffer) >= self.max_buffer:
+                self._buffer.popleft()
+                LOKI_RECORDS_DROPPED.labels(reason="buffer_full").inc()
+            self._buffer.append(entry)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def _take_batch(self) -> List[Entry]:
+        with self._buffer_lock:
+            size = min(self.batch_size, len(self._buffer))
+            return [self._buffer.popleft() for _ in range(size)]
+
+    def payload(self, batch: List[Entry]) -> bytes:
+        streams: Dict[str, list] = {}
+        for level, timestamp, line in batch:
+            streams.setdefault(level, []).append([timestamp, line])
+        body = json.dumps(
+            {
+                "streams": [
+                    {"stream": {**self.labels, "level": level}, "values": values}
+                    for level, values in streams.items()
+                ]
+            },
+            ensure_ascii=False,
+        ).encode("utf-8")
+        return gzip.compress(body, compresslevel=5) if self.compress else body
+
+    def push(self, batch: List[Entry], retries: Optional[int] = None) -> bool:
+        payload = self.payload(batch)
+        retries = self.max_retries if retries is None else retries
+        for attempt in range(retries + 1):
+            try:
+                response = self.client.post(self.url, content=payload)
+            except httpx.HTTPError:
+                retryable = True
+            else:
+                if response.status_code < 300:
+                    LOKI_RECORDS_SENT.inc(len(batch))
+                    return True
+                retryable = response.status_code == 429 or response.status_code >= 500
+            LOKI_PUSH_FAILURES.inc()
+            if not retryable or attempt == retries or self._stopping.is_set():
+                break
+            delay = min(self.max_backoff, self.backoff * 2**attempt)
+            self._stopping.wait(delay * random.uniform(0.5, 1.0))
+        LOKI_RECORDS_DROPPED.labels(reason="push_failed").inc(len(batch))
+        return False
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    break
+                self.push(batch)
+                if len(batch) < self.batch_size:
+                    break
+
+    def flush(self) -> None:
+        # NOTE: the sender thread pushes, flush only wakes it up
+        self._wakeup.set()
+
+    def close(self) -> None:
+        if not self._stopping.is_set():
+            self._stopping.set()
+            self._wakeup.set()
+            self._sender.join()
+            # NOTE: one last attempt per batch, do not hold up the shutdown
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    break
+                self.push(batch, retries=0)
+            self.client.close()
+        super().close()
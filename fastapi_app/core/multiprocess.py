@@ -0,0 +1,110 @@
+import fcntl
+import glob
+import os
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+from prometheus_client.metrics_core import Metric
+from prometheus_client.mmap_dict import MmapedDict
+from prometheus_client.multiprocess import MultiProcessCollector
+
+# NOTE: prometheus_client reads it on import, so it has to be exported before
+# the workers start, and the directory should be emptied on every deploy
+MULTIPROC_DIR = os.environ.get(
+    "PROMETHEUS_MULTIPROC_DIR", os.environ.get("prometheus_multiproc_dir", "")
+)
+# NOTE: aggregation of fastapi_requests_in_progress across workers
+IN_PROGRESS_MULTIPROCESS_MODE = os.environ.get(
+    "PROMETHEUS_IN_PROGRESS_MODE", "livesum"
+)
+
+ARCHIVE_PID = "archive"
+ACCUMULATED_TYPES = ("counter", "histogram", "summary")
+LOCK_FILE = ".lock"
+
+
+def is_multiprocess_mode() -> bool:
+    return bool(MULTIPROC_DIR)
+
+
+@contextmanager
+def locked(path: str) -> Iterator[None]:
+    """Serialize compaction and collection between workers sharing ``path``"""
+    with open(os.path.join(path, LOCK_FILE), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def worker_pids(path: str) -> List[int]:
+    pids = set()
+    for filename in glob.glob(os.path.join(path, "*.db")):
+        pid = os.path.basename(filename)[:-3].rsplit("_", 1)[-1]
+        if pid.isdigit():
+            pids.add(int(pid))
+    return sorted(pids)
+
+
+def compact_worker_files(pid: int, path: str) -> None:
+    """Fold a dead worker's counters and histograms into ``<type>_archive.db``
+    so totals never go backwards, and drop its gauges. Lock must be held by caller.
+    """
+    for filename in glob.glob(os.path.join(path, f"*_{pid}.db")):
+        typ = os.path.basename(filename).split("_", 1)[0]
+        if typ in ACCUMULATED_TYPES:
+            archive = MmapedDict(os.path.join(path, f"{typ}_{ARCHIVE_PID}.db"))
+            try:
+                for key, value, timestamp, _ in MmapedDict.read_all_values_from_file(
+                    filename
+                ):
+                    current, _ = archive.read_value(key)
+                    archive.write_value(key, current + value, timestamp)
+            finally:
+                archive.close()
+        os.remove(filename)
+
+
+def mark_worker_dead(pid: int, path: Optional[str] = None) -> None:
+    """
+    Bookkeeping for a worker that exited, e.g. from gunicorn's ``child_exit`` hook:
+
+        def child_exit(server, worker):
+            mark_worker_dead(worker.pid)
+    """
+    path = path or MULTIPROC_DIR
+    with locked(path):
+        compact_worker_files(pid, path)
+
+
+def cleanup_dead_workers(path: str) -> List[int]:
+    """Compact files of every pid that is no longer running. Lock must be held by caller."""
+    current_pid = os.getpid()
+    dead = [
+        pid
+        for pid in worker_pids(path)
+        if pid != current_pid and not is_process_alive(pid)
+    ]
+    for pid in dead:
+        compact_worker_files(pid, path)
+    return dead
+
+
+def collect_multiprocess(path: Optional[str] = None) -> List[Metric]:
+    """Merge the per-PID mmap files of all workers"""
+    path = path or MULTIPROC_DIR
+    with locked(path):
+        cleanup_dead_workers(path)
+        return list(MultiProcessCollector(None, path=path).collect())
+
@@ -0,0 +1,101 @@
+from typing import Dict
+
+from opentelemetry.metrics import Meter
+
+# NOTE: same names, descriptions and attributes as the Prometheus families in utils.py
+REQUESTS = ("fastapi_requests_total", "Total count of requests by method and path.")
+RESPONSES = (
+    "fastapi_responses_total",
+    "Total count of responses by method, path and status codes.",
+)
+REQUESTS_PROCESSING_TIME = (
+    "fastapi_requests_duration_seconds",
+    "Histogram of requests processing time by path (in seconds)",
+)
+EXCEPTIONS = (
+    "fastapi_exceptions_total",
+    "Total count of exceptions raised by path and exception type",
+)
+REQUESTS_IN_PROGRESS = (
+    "fastapi_requests_in_progress",
+    "Gauge of requests by method and path currently being processed",
+)
+
+
+class OTLPMetrics:
+    """The request metric families as OpenTelemetry instruments.
+
+    Built by ``utils.setting_otlp_metrics``, which owns the meter provider
+    and its periodic OTLP exporter; recording is a plain ``add``/``record``
+    and encoding happens in the exporter thread.
+    """
+
+    def __init__(self, meter: Meter, provider=None) -> None:
+        self.provider = provider
+        self.requests = meter.create_counter(REQUESTS[0], description=REQUESTS[1])
+        self.responses = meter.create_counter(RESPONSES[0], description=RESPONSES[1])
+        self.requests_processing_time = meter.create_histogram(
+            REQUESTS_PROCESSING_TIME[0],
+            unit="s",
+            description=REQUESTS_PROCESSING_TIME[1],
+        )
+        self.exceptions = meter.create_counter(
+            EXCEPTIONS[0], description=EXCEPTIONS[1]
+        )
+        self.requests_in_progress = meter.create_up_down_counter(
+            REQUESTS_IN_PROGRESS[0], description=REQUESTS_IN_PROGRESS[1]
+        )
+
+    def route(self, method: str, path: str, app_name: str) -> "OTLPRouteMetrics":
+        return OTLPRouteMetrics(self, method, path, app_name)
+
+    def shutdown(self) -> None:
+        """Export the last deltas and stop the reader, safe to call twice"""
+        provider, self.provider = self.provider, None
+        if provider is not None:
+            provider.shutdown()
+
+
+class OTLPRouteMetrics:
+    """Attribute dicts built once per (method, path, app_name), like RouteMetrics
+
+    Values are not folded by the CardinalityGuard, route templates and
+    status codes are bounded already.
+    """
+
+    __slots__ = ("metrics", "attributes", "_responses", "_exceptions")
+
+    def __init__(
+        self, metrics: OTLPMetrics, method: str, path: str, app_name: str
+    ) -> None:
+        self.metrics = metrics
+        self.attributes = {"method": method, "path": path, "app_name": app_name}
+        self._responses: Dict[int, dict] = {}
+        self._exceptions: Dict[str, dict] = {}
+
+    def started(self) -> None:
+        self.metrics.requests.add(1, self.attributes)
+        self.metrics.requests_in_progress.add(1, self.attributes)
+
+    def observe(self, duration: float) -> None:
+        self.metrics.requests_processing_time.record(duration, self.attributes)
+
+    def exception(self, exception_type: str) -> None:
+        attributes = self._exceptions.get(exception_type)
+        if attributes is None:
+            attributes = self._exceptions[exception_type] = {
+                **self.attributes,
+                "exception_type": exception_type,
+            }
+        self.metrics.exceptions.add(1, attributes)
+
+    def finished(self, status_code: int) -> None:
+        attributes = self._responses.get(status_code)
+        if attributes is None:
+            attributes = self._responses[status_code] = {
+                **self.attributes,
+                "status_code": str(status_code),
+            }
+        self.metrics.responses.add(1, attributes)
+        self.metrics.requests_in_progress.add(-1, self.attributes)
+
@@ -0,0 +1,11 @@
+from typing import Dict
+
+
+def parse_rates(value: str) -> Dict[str, float]:
+    """``"/api/v1/items=0.1,/metrics=0"`` -> ``{"/api/v1/items": 0.1, "/metrics": 0.0}``"""
+    rates = {}
+    for item in value.split(","):
+        key, sep, rate = item.strip().rpartition("=")
+        if sep and key:
+            rates[key.strip()] = float(rate)
+    return rates
@@ -0,0 +1,221 @@
+"""
+Prometheus protobuf exposition (``io.prometheus.client.MetricFamily``, delimited)
+
+prometheus_client only writes the text formats, native histograms can only
+be scraped in this format. The few messages needed are encoded by hand,
+field numbers follow prometheus/client_model ``metrics.proto``.
+"""
+import struct
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from prometheus_client.metrics_core import Metric
+from prometheus_client.samples import Exemplar, Sample
+
+from fastapi_app.core.exp_histogram import NativeHistogram
+
+CONTENT_TYPE_PROTOBUF = (
+    "application/vnd.google.protobuf; "
+    "proto=io.prometheus.client.MetricFamily; encoding=delimited"
+)
+
+# NOTE: MetricType enum
+COUNTER, GAUGE, SUMMARY, UNTYPED, HISTOGRAM, GAUGE_HISTOGRAM = range(6)
+METRIC_TYPES = {
+    "counter": COUNTER,
+    "gauge": GAUGE,
+    "summary": SUMMARY,
+    "histogram": HISTOGRAM,
+    "gaugehistogram": GAUGE_HISTOGRAM,
+    "info": GAUGE,
+    "stateset": GAUGE,
+}
+# NOTE: families whose protobuf name carries the sample suffix
+NAME_SUFFIXES = {"counter": "_total", "info": "_info"}
+# NOTE: label that splits the samples of one series
+GROUPING_LABELS = {"histogram": "le", "gaugehistogram": "le", "summary": "quantile"}
+
+_VARINT, _FIXED64, _LENGTH = 0, 1, 2
+_double = struct.Struct("<d").pack
+
+
+def varint(value: int) -> bytes:
+    if value < 0:
+        value += 1 << 64
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field: int, wire_type: int) -> bytes:
+    return varint((field << 3) | wire_type)
+
+
+def _uint(field: int, value: int) -> bytes:
+    return _key(field, _VARINT) + varint(value)
+
+
+def _sint(field: int, value: int) -> bytes:
+    return _key(field, _VARINT) + varint(zigzag(value))
+
+
+def _float(field: int, value: float) -> bytes:
+    return _key(field, _FIXED64) + _double(value)
+
+
+def _message(field: int, payload: bytes) -> bytes:
+    return _key(field, _LENGTH) + varint(len(payload)) + payload
+
+
+def _string(field: int, value: str) -> bytes:
+    return _message(field, value.encode("utf-8"))
+
+
+def _labels(labels: Dict[str, str]) -> bytes:
+    return b"".join(
+        _message(1, _string(1, name) + _string(2, value))
+        for name, value in labels.items()
+    )
+
+
+def _exemplar(field: int, exemplar: Exemplar) -> bytes:
+    payload = _labels(exemplar.labels) + _float(2, exemplar.value)
+    if exemplar.timestamp is not None:
+        seconds = int(exemplar.timestamp)
+        nanos = int((exemplar.timestamp - seconds) * 1e9)
+        payload += _message(3, _uint(1, seconds) + _uint(2, nanos))
+    return _message(field, payload)
+
+
+def _native_fields(native: NativeHistogram) -> bytes:
+    out = [
+        _sint(5, native.schema),
+        _float(6, native.zero_threshold),
+        _uint(7, native.zero_count),
+    ]
+    spans: List[bytes] = []
+    deltas: List[bytes] = []
+    previous_index: Optional[int] = None
+    previous_count = 0
+    span_offset = span_length = 0
+    for index, count in native.buckets:
+        if previous_index is None or index != previous_index + 1:
+            if span_length:
+                spans.append(_message(12, _sint(1, span_offset) + _uint(2, span_length)))
+            span_offset = index if previous_index is None else index - previous_index - 1
+            span_length = 0
+        span_length += 1
+        deltas.append(_sint(13, count - previous_count))
+        previous_index, previous_count = index, count
+    if span_length:
+        spans.append(_message(12, _sint(1, span_offset) + _uint(2, span_length)))
+    elif not native.zero_count:
+        # NOTE: an empty span tells the scraper an empty histogram is native too
+        spans.append(_message(12, _sint(1, 0) + _uint(2, 0)))
+    out.extend(spans)
+    out.extend(deltas)
+    out.extend(_exemplar(16, exemplar) for exemplar in native.exemplars)
+    return b"".join(out)
+
+
+class _Series:
+    __slots__ = ("labels", "samples")
+
+    def __init__(self, labels: Dict[str, str]) -> None:
+        self.labels = labels
+        self.samples: List[Sample] = []
+
+
+def _group(metric: Metric, grouping_label: Optional[str]) -> List[_Series]:
+    series: Dict[FrozenSet[Tuple[str, str]], _Series] = OrderedDict()
+    for sample in metric.samples:
+        labels = {
+            name: value
+            for name, value in sample.labels.items()
+            if name != grouping_label
+        }
+        key = frozenset(labels.items())
+        if key not in series:
+            series[key] = _Series(labels)
+        series[key].samples.append(sample)
+    return list(series.values())
+
+
+def _metric(metric: Metric, series: _Series) -> bytes:
+    typ = metric.type
+    payload = _labels(series.labels)
+    if typ in ("histogram", "gaugehistogram"):
+        body: List[bytes] = []
+        count = total = 0.0
+        for sample in series.samples:
+            suffix = sample.name[len(metric.name) :]
+            if suffix == "_bucket":
+                bucket = _uint(1, int(sample.value)) + _float(
+                    2, float(sample.labels["le"])
+                )
+                if sample.exemplar is not None:
+                    bucket += _exemplar(3, sample.exemplar)
+                body.append(_message(3, bucket))
+            elif suffix in ("_count", "_gcount"):
+                count = sample.value
+            elif suffix in ("_sum", "_gsum"):
+                total = sample.value
+        histogram = _uint(1, int(count)) + _float(2, total) + b"".join(body)
+        native = getattr(metric, "native", {}).get(frozenset(series.labels.items()))
+        if native is not None:
+            histogram += _native_fields(native)
+        return payload + _message(7, histogram)
+    if typ == "summary":
+        body = []
+        count = total = 0.0
+        for sample in series.samples:
+            suffix = sample.name[len(metric.name) :]
+            if suffix == "_count":
+                count = sample.value
+            elif suffix == "_sum":
+                total = sample.value
+            elif "quantile" in sample.labels:
+                body.append(
+                    _message(
+                        3,
+                        _float(1, float(sample.labels["quantile"]))
+                        + _float(2, sample.value),
+                    )
+                )
+        return payload + _message(
+            4, _uint(1, int(count)) + _float(2, total) + b"".join(body)
+        )
+
+    name = metric.name + NAME_SUFFIXES.get(typ, "")
+    value = next(
+        (sample for sample in series.samples if sample.name == name),
+        series.samples[0],
+    )
+    if typ == "counter":
+        counter = _float(1, value.value)
+        if value.exemplar is not None:
+            counter += _exemplar(2, value.exemplar)
+        return payload + _message(3, counter)
+    field = 5 if typ == "unknown" else 2
+    return payload + _message(field, _float(1, value.value))
+
+
+def encode_family(metric: Metric) -> bytes:
+    """One length-delimited ``MetricFamily`` message"""
+    typ = metric.type
+    name = metric.name + NAME_SUFFIXES.get(typ, "")
+    series = _group(metric, GROUPING_LABELS.get(typ))
+    family = (
+        _string(1, name)
+        + _string(2, metric.documentation)
+        + _uint(3, METRIC_TYPES.get(typ, UNTYPED))
+        + b"".join(_message(4, _metric(metric, entry)) for entry in series)
+    )
+    return varint(len(family)) + family
@@ -0,0 +1,337 @@
+import glob
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Mapping, Optional, Tuple
+
+# NOTE: window name -> seconds
+WINDOWS = {"1m": 60, "5m": 300, "15m": 900}
+QUANTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99, "p999": 0.999}
+SKETCH_FILE_PREFIX = "latency_sketches_"
+
+
+class DDSketch:
+    """Quantile sketch with relative-error guarantees (DDSketch).
+
+    Values are counted in logarithmic bins ``(gamma^(k-1), gamma^k]`` with
+    ``gamma = (1 + relative_accuracy) / (1 - relative_accuracy)``, so every
+    quantile is within ``relative_accuracy`` of the exact value. Sketches
+    with the same accuracy merge by adding bins. Memory is bounded by
+    ``max_bins``: past it the lowest bins are collapsed, only low quantiles
+    lose accuracy. Values up to ``min_value`` are counted as zero.
+    """
+
+    __slots__ = (
+        "relative_accuracy",
+        "max_bins",
+        "min_value",
+        "gamma",
+        "multiplier",
+        "count",
+        "zero_count",
+        "floor",
+        "bins",
+    )
+
+    def __init__(
+        self,
+        relative_accuracy: float = 0.01,
+        max_bins: int = 2048,
+        min_value: float = 1e-9,
+    ) -> None:
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be in (0, 1)")
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.multiplier = 1 / math.log(self.gamma)
+        self.count = 0
+        self.zero_count = 0
+        # NOTE: bins below it were collapsed into it
+        self.floor = -math.inf
+        self.bins: Dict[int, int] = {}
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        if value <= self.min_value:
+            self.zero_count += 1
+            return
+        key = math.ceil(math.log(value) * self.multiplier)
+        if key < self.floor:
+            key = self.floor
+        bins = self.bins
+        bins[key] = bins.get(key, 0) + 1
+        if len(bins) > self.max_bins:
+            self._collapse()
+
+    def _collapse(self) -> None:
+        keys = sorted(self.bins)
+        floor = keys[len(keys) - self.max_bins]
+        bins = self.bins
+        for key in keys:
+            if key >= floor:
+                break
+            bins[floor] += bins.pop(key)
+        self.floor = floor
+
+    def merge(self, other: "DDSketch") -> None:
+        if other.gamma != self.gamma:
+            raise ValueError("cannot merge sketches with a different accuracy")
+        self.count += other.count
+        self.zero_count += other.zero_count
+        if other.floor > self.floor:
+            self.floor = other.floor
+        bins = self.bins
+        for key, count in list(other.bins.items()):
+            bins[key] = bins.get(key, 0) + count
+        if self.floor > -math.inf:
+            for key in [key for key in bins if key < self.floor]:
+                bins[self.floor] = bins.get(self.floor, 0) + bins.pop(key)
+        if len(bins) > self.max_bins:
+            self._collapse()
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        key = None
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                break
+        return 2 * self.gamma**key / (self.gamma + 1)
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "zero_count": self.zero_count,
+            "floor": None if self.floor == -math.inf else self.floor,
+            "bins": list(self.bins.items()),
+        }
+
+    @classmethod
+    def from_dict(
+        cls,
+        data: Mapping,
+        relative_accuracy: float = 0.01,
+        max_bins: int = 2048,
+    ) -> "DDSketch":
+        sketch = cls(relative_accuracy, max_bins)
+        sketch.count = data["count"]
+        sketch.zero_count = data["zero_count"]
+        if data["floor"] is not None:
+            sketch.floor = data["floor"]
+        sketch.bins = {int(key): count for key, count in data["bins"]}
+        return sketch
+
+
+class SlidingSketch:
+    """DDSketches of consecutive ``slot_seconds`` slots over ``window_seconds``
+
+    Slots are aligned on the wall clock so workers can merge them. ``add``
+    only takes the lock when a new slot starts, the per-request update is a
+    dict increment on the current slot's sketch.
+    """
+
+    __slots__ = (
+        "relative_accuracy",
+        "max_bins",
+        "slot_seconds",
+        "slots",
+        "_current",
+        "_current_slot",
+        "_lock",
+    )
+
+    def __init__(
+        self,
+        relative_accuracy: float = 0.01,
+        max_bins: int = 2048,
+        slot_seconds: int = 10,
+        window_seconds: int = 900,
+    ) -> None:
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.slot_seconds = slot_seconds
+        self.slots: Deque[Tuple[int, DDSketch]] = deque(
+            maxlen=-(-window_seconds // slot_seconds)
+        )
+        self._current = DDSketch(relative_accuracy, max_bins)
+        self._current_slot = -1
+        self._lock = threading.Lock()
+
+    def add(self, value: float, now: Optional[float] = None) -> None:
+        slot = int((time.time() if now is None else now) // self.slot_seconds)
+        if slot != self._current_slot:
+            with self._lock:
+                if slot != self._current_slot:
+                    self._current = DDSketch(self.relative_accuracy, self.max_bins)
+                    self.slots.append((slot, self._current))
+                    self._current_slot = slot
+        self._current.add(value)
+
+    def snapshot(self) -> List[Tuple[int, DDSketch]]:
+        with self._lock:
+            return list(self.slots)
+
+
+def merge_window(
+    slots: Iterable[Tuple[int, DDSketch]],
+    oldest_slot: int,
+    relative_accuracy: float,
+    max_bins: int,
+) -> DDSketch:
+    merged = DDSketch(relative_accuracy, max_bins)
+    for slot, sketch in slots:
+        if slot >= oldest_slot:
+            merged.merge(sketch)
+    return merged
+
+
+class LatencySketches:
+    """Sliding-window latency sketches per (method, route template).
+
+    With ``path`` set (the multiprocess directory) every worker dumps its
+    slots to ``latency_sketches_<pid>.json`` every ``flush_interval``
+    seconds from a background thread, and ``stats`` merges the files of the
+    other workers with its own slots. Their data is up to
+    ``flush_interval`` seconds late. Files whose newest slot left the
+    longest window are removed.
+    """
+
+    def __init__(
+        self,
+        relative_accuracy: float = 0.01,
+        max_bins: int = 2048,
+        slot_seconds: int = 10,
+        windows: Mapping[str, int] = WINDOWS,
+        path: Optional[str] = None,
+        flush_interval: float = 10.0,
+    ) -> None:
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.slot_seconds = slot_seconds
+        self.windows = dict(windows)
+        self.window_seconds = max(self.windows.values())
+        self.path = path
+        self.flush_interval = flush_interval
+        self.routes: Dict[str, SlidingSketch] = {}
+        self._lock = threading.Lock()
+        self._flusher_pid: Optional[int] = None
+
+    def route(self, method: str, path: str) -> SlidingSketch:
+        key = f"{method} {path}"
+        sketch = self.routes.get(key)
+        if sketch is None:
+            with self._lock:
+                sketch = self.routes.get(key)
+                if sketch is None:
+                    sketch = self.routes[key] = SlidingSketch(
+                        self.relative_accuracy,
+                        self.max_bins,
+                        self.slot_seconds,
+                        self.window_seconds,
+                    )
+                # NOTE: started in the worker, not in a pre-forking master
+                if self.path and self._flusher_pid != os.getpid():
+                    self._flusher_pid = os.getpid()
+                    threading.Thread(
+                        target=self._run, name="latency-sketches", daemon=True
+                    ).start()
+        return sketch
+
+    def _file(self, pid: int) -> str:
+        return os.path.join(self.path or "", f"{SKETCH_FILE_PREFIX}{pid}.json")
+
+    def dump(self) -> None:
+        data = {
+            key: [(slot, sketch.to_dict()) for slot, sketch in sketch.snapshot()]
+            for key, sketch in list(self.routes.items())
+        }
+        filename = self._file(os.getpid())
+        with open(filename + ".tmp", "w") as file:
+            json.dump(data, file, separators=(",", ":"))
+        os.replace(filename + ".tmp", filename)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.dump()
+            except OSError:
+                pass
+
+    def _load_workers(self, oldest_slot: int) -> List[Dict[str, list]]:
+        workers = []
+        own = self._file(os.getpid())
+        pattern = os.path.join(self.path or "", f"{SKETCH_FILE_PREFIX}*.json")
+        for filename in glob.glob(pattern):
+            if filename == own:
+                continue
+            try:
+                with open(filename) as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue
+            newest = max(
+                (slot for slots in data.values() for slot, _ in slots), default=-1
+            )
+            if newest < oldest_slot:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+                continue
+            workers.append(
+                {
+                    key: [
+                        (
+                            slot,
+                            DDSketch.from_dict(
+                                sketch, self.relative_accuracy, self.max_bins
+                            ),
+                        )
+                        for slot, sketch in slots
+                    ]
+                    for key, slots in data.items()
+                }
+            )
+        return workers
+
+    def stats(
+        self,
+        quantiles: Mapping[str, float] = QUANTILES,
+        now: Optional[float] = None,
+    ) -> dict:
+        current_slot = int((time.time() if now is None else now) // self.slot_seconds)
+        slots: Dict[str, List[Tuple[int, DDSketch]]] = {
+            key: sketch.snapshot() for key, sketch in list(self.routes.items())
+        }
+        if self.path:
+            longest = current_slot - self.window_seconds // self.slot_seconds + 1
+            for worker in self._load_workers(longest):
+                for key, worker_slots in worker.items():
+                    slots.setdefault(key, []).extend(worker_slots)
+
+        routes = {}
+        for key, route_slots in sorted(slots.items()):
+            routes[key] = {}
+            for window, seconds in self.windows.items():
+                sketch = merge_window(
+                    route_slots,
+                    current_slot - seconds // self.slot_seconds + 1,
+                    self.relative_accuracy,
+                    self.max_bins,
+                )
+                routes[key][window] = {
+                    "count": sketch.count,
+                    **{name: sketch.quantile(q) for name, q in quantiles.items()},
+                }
+        return {"relative_accuracy": self.relative_accuracy, "routes": routes}
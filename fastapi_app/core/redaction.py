@@ -0,0 +1,94 @@
+import json
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi_app.core.settings import settings
+
+RawHeaders = Iterable[Tuple[bytes, bytes]]
+
+
+def _names(value: Optional[Iterable[str]]) -> frozenset:
+    return frozenset(name.strip().lower().encode("latin-1") for name in value or ())
+
+
+def split_names(value: str) -> List[str]:
+    """``"cookie, set-cookie"`` -> ``["cookie", "set-cookie"]``"""
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+class RedactionPolicy:
+    """Header and body redaction compiled once at startup.
+
+    Headers are filtered on the raw ASGI ``(name, value)`` byte pairs, whose
+    names are already lower-cased by the server: denied headers are skipped,
+    masked ones are replaced without decoding and only the logged values are
+    decoded. ``allow_headers`` (when given) keeps only the listed headers.
+    ``body_fields`` are dotted paths stripped from JSON object bodies, e.g.
+    ``data`` or ``user.password``.
+    """
+
+    def __init__(
+        self,
+        allow_headers: Optional[Iterable[str]] = None,
+        deny_headers: Iterable[str] = ("cookie", "set-cookie"),
+        mask_headers: Iterable[str] = ("authorization", "proxy-authorization"),
+        body_fields: Iterable[str] = ("data",),
+        mask: str = "****",
+    ) -> None:
+        self.allow_headers = _names(allow_headers) or None
+        self.deny_headers = _names(deny_headers)
+        self.mask_headers = _names(mask_headers)
+        self.mask = mask
+        self.body_paths = [tuple(path.split(".")) for path in body_fields]
+        # NOTE: a body without any of these keys is logged without parsing it
+        self._body_markers = {f'"{path[0]}"' for path in self.body_paths}
+
+    def headers(self, raw: RawHeaders) -> Dict[str, str]:
+        logged = {}
+        for name, value in raw:
+            if name in self.deny_headers:
+                continue
+            if self.allow_headers is not None and name not in self.allow_headers:
+                continue
+            key = name.decode("latin-1")
+            if name in self.mask_headers:
+                logged[key] = self.mask
+            elif key in logged:
+                logged[key] = f"{logged[key]}, {value.decode('latin-1')}"
+            else:
+                logged[key] = value.decode("latin-1")
+        return logged
+
+    def body(self, text: Optional[str]) -> Optional[str]:
+        if not text or not self.body_paths or not text.lstrip().startswith("{"):
+            return text
+        if not any(marker in text for marker in self._body_markers):
+            return text
+        try:
+            body = json.loads(text)
+        except ValueError:
+            # NOTE: cannot strip fields from a body that does not parse
+            return None
+
+        stripped = False
+        for path in self.body_paths:
+            stripped |= _strip(body, path)
+        return json.dumps(body, ensure_ascii=False) if stripped else text
+
+
+def _strip(body, path: Tuple[str, ...]) -> bool:
+    for key in path[:-1]:
+        if not isinstance(body, dict):
+            return False
+        body = body.get(key)
+    if isinstance(body, dict) and path[-1] in body:
+        del body[path[-1]]
+        return True
+    return False
+
+
+REDACTION_POLICY = RedactionPolicy(
+    allow_headers=split_names(settings.LOG_REDACT_ALLOW_HEADERS),
+    deny_headers=split_names(settings.LOG_REDACT_DENY_HEADERS),
+    mask_headers=split_names(settings.LOG_REDACT_MASK_HEADERS),
+    body_fields=split_names(settings.LOG_REDACT_BODY_FIELDS),
+)
@@ -0,0 +1,106 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from starlette.routing import BaseRoute, Match, Route
+from starlette.types import Scope
+
+RouteCandidates = Tuple[BaseRoute, ...]
+
+
+class RouteResolver:
+    """Resolve the route template of a request without scanning every route.
+
+    The index is built from ``app.routes`` on first use and rebuilt whenever
+    the route list changes:
+
+    - static paths (no ``{param}``) are looked up in a dict
+    - parameterised routes are grouped by segment count
+    - ``{name:path}`` routes, mounts and anything else are checked for every path
+
+    Candidates keep declaration order, so the first matching route wins just
+    like in ``starlette.routing.Router``. Recent ``(method, path)`` results are
+    memoized in a bounded LRU.
+    """
+
+    def __init__(self, cache_size: int = 1024) -> None:
+        self.cache_size = cache_size
+        self._version: Optional[Tuple[int, int]] = None
+        self._static: Dict[str, RouteCandidates] = {}
+        self._by_segments: Dict[int, RouteCandidates] = {}
+        self._catch_all: RouteCandidates = ()
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[str, bool]]" = OrderedDict()
+
+    def invalidate(self) -> None:
+        self._version = None
+        self._static = {}
+        self._by_segments = {}
+        self._catch_all = ()
+        self._cache.clear()
+
+    def build(self, routes: Sequence[BaseRoute]) -> None:
+        static: Dict[str, List[Tuple[int, BaseRoute]]] = {}
+        by_segments: Dict[int, List[Tuple[int, BaseRoute]]] = {}
+        catch_all: List[Tuple[int, BaseRoute]] = []
+
+        for index, route in enumerate(routes):
+            path = getattr(route, "path", None)
+            if not isinstance(route, Route) or not path:
+                catch_all.append((index, route))
+            elif "{" not in path:
+                static.setdefault(path, []).append((index, route))
+            elif ":path}" in path:
+                catch_all.append((index, route))
+            else:
+                by_segments.setdefault(path.count("/"), []).append((index, route))
+
+        def merge(*groups: List[Tuple[int, BaseRoute]]) -> RouteCandidates:
+            return tuple(route for _, route in sorted(sum(groups, [])))
+
+        self._catch_all = merge(catch_all)
+        self._by_segments = {
+            segments: merge(candidates, catch_all)
+            for segments, candidates in by_segments.items()
+        }
+        self._static = {
+            path: merge(
+                candidates, by_segments.get(path.count("/"), []), catch_all
+            )
+            for path, candidates in static.items()
+        }
+        self._cache.clear()
+        self._version = (id(routes), len(routes))
+
+    def resolve(self, scope: Scope) -> Tuple[str, bool]:
+        """Return ``(path template, is handled)`` for an ASGI http scope"""
+        # NOTE: reuse the route already resolved by an outer router (mounted apps)
+        route = scope.get("route")
+        if route is not None and getattr(route, "path", None):
+            return route.path, True
+
+        routes = scope["app"].routes
+        if self._version != (id(routes), len(routes)):
+            self.build(routes)
+
+        path = scope["path"]
+        key = (scope["method"], path)
+        cache = self._cache
+        result = cache.get(key)
+        if result is not None:
+            cache.move_to_end(key)
+            return result
+
+        candidates = self._static.get(path)
+        if candidates is None:
+            candidates = self._by_segments.get(path.count("/"), self._catch_all)
+
+        result = (path, False)
+        for route in candidates:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                result = (route.path, True)
+                break
+
+        cache[key] = result
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return result
@@ -4,6 +4,77 @@ from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     PROMETHEUS_ENABLE: str = config("PROMETHEUS_ENABLE", default="true")
+    PROJECT_NAME: str = config(
+        "PROJECT_NAME", default=config("APP_NAME", default="app")
+    )
+    API_VERSION: str = config("API_VERSION", default="v1")
+    ENVIRONMENT: str = config("ENVIRONMENT", default="dev")
+    DEBUG: bool = config("DEBUG", default=False, cast=bool)
+    PORT: int = config("PORT", default=8000, cast=int)
+    # NOTE: format and write logs in a listener thread instead of the event loop
+    LOG_ASYNC: bool = config("LOG_ASYNC", default=False, cast=bool)
+    LOG_QUEUE_SIZE: int = config("LOG_QUEUE_SIZE", default=10000, cast=int)
+    # NOTE: block, drop-debug-first or drop-oldest
+    LOG_QUEUE_OVERFLOW: str = config("LOG_QUEUE_OVERFLOW", default="drop-oldest")
+    # NOTE: FastJSONLogFormatter for the json file log instead of JSONLogFormatter
+    LOG_FAST_JSON: bool = config("LOG_FAST_JSON", default=False, cast=bool)
+    # NOTE: json or orjson, orjson lines are not byte-compatible with
+    # JSONLogFormatter (compact separators)
+    LOG_FAST_JSON_BACKEND: str = config("LOG_FAST_JSON_BACKEND", default="json")
+    # NOTE: full stackprinter render once per exception fingerprint and window,
+    # at most LOG_EXCEPTION_RENDER_BUDGET renders per window (0: no budget)
+    LOG_EXCEPTION_RENDER_WINDOW: float = config(
+        "LOG_EXCEPTION_RENDER_WINDOW", default=60.0, cast=float
+    )
+    LOG_EXCEPTION_RENDER_BUDGET: int = config(
+        "LOG_EXCEPTION_RENDER_BUDGET", default=20, cast=int
+    )
+    # NOTE: sample access and other logs, errors, slow requests and sampled
+    # traces are always kept
+    LOG_SAMPLING: bool = config("LOG_SAMPLING", default=False, cast=bool)
+    LOG_SAMPLE_RATE: float = config("LOG_SAMPLE_RATE", default=1.0, cast=float)
+    # NOTE: e.g. "/api/v1/items=0.1,/api/v1/users/{user_id}=0.5"
+    LOG_SAMPLE_ROUTE_RATES: str = config("LOG_SAMPLE_ROUTE_RATES", default="")
+    # NOTE: e.g. "DEBUG=0.01,INFO=0.1"
+    LOG_SAMPLE_LEVEL_RATES: str = config("LOG_SAMPLE_LEVEL_RATES", default="")
+    LOG_SAMPLE_SLOW_MS: int = config("LOG_SAMPLE_SLOW_MS", default=1000, cast=int)
+    LOG_SAMPLE_KEEP_TRACES: bool = config(
+        "LOG_SAMPLE_KEEP_TRACES", default=True, cast=bool
+    )
+    # NOTE: comma separated header names and dotted JSON body paths, an empty
+    # allow list logs every header that is not denied
+    LOG_REDACT_ALLOW_HEADERS: str = config("LOG_REDACT_ALLOW_HEADERS", default="")
+    LOG_REDACT_DENY_HEADERS: str = config(
+        "LOG_REDACT_DENY_HEADERS", default="cookie,set-cookie"
+    )
+    LOG_REDACT_MASK_HEADERS: str = config(
+        "LOG_REDACT_MASK_HEADERS", default="authorization,proxy-authorization"
+    )
+    LOG_REDACT_BODY_FIELDS: str = config("LOG_REDACT_BODY_FIELDS", default="data")
+    # NOTE: comma separated path prefixes whose request bodies are logged,
+    # empty logs every route (only content types of REQUEST_BODY_LIMITS)
+    LOG_REQUEST_BODY_ROUTES: str = config("LOG_REQUEST_BODY_ROUTES", default="")
+    # NOTE: also keep the whole request body as request.state.request_body_file,
+    # in memory up to LOG_REQUEST_BODY_SPILL_SIZE bytes then in a temp file
+    LOG_REQUEST_BODY_FULL: bool = config(
+        "LOG_REQUEST_BODY_FULL", default=False, cast=bool
+    )
+    LOG_REQUEST_BODY_SPILL_SIZE: int = config(
+        "LOG_REQUEST_BODY_SPILL_SIZE", default=1024 * 1024, cast=int
+    )
+    # NOTE: JSONLinesFileHandler as file_handler instead of RotatingFileHandler,
+    # rotated segments are gzipped in the background
+    LOG_FILE_SINK: bool = config("LOG_FILE_SINK", default=False, cast=bool)
+    # NOTE: also rotate every LOG_FILE_ROTATE_SECONDS (86400: daily), 0: size only
+    LOG_FILE_ROTATE_SECONDS: int = config(
+        "LOG_FILE_ROTATE_SECONDS", default=0, cast=int
+    )
+    LOG_FILE_COMPRESS: bool = config("LOG_FILE_COMPRESS", default=True, cast=bool)
+    # NOTE: push JSON logs to Loki, e.g. http://loki:3100/loki/api/v1/push,
+    # instead of scraping stdout with the Loki docker driver
+    LOG_LOKI_URL: str = config("LOG_LOKI_URL", default="")
+    # NOTE: write loguru sinks (intercept handler) from loguru's own thread
+    LOG_LOGURU_ENQUEUE: bool = config("LOG_LOGURU_ENQUEUE", default=False, cast=bool)
 
     # class Config:
     #     case_sensitive = True
@@ -0,0 +1,111 @@
+import time
+from typing import Callable, Optional, Sequence
+
+from opentelemetry.sdk.trace import ReadableSpan
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    SpanExporter,
+    SpanExportResult,
+)
+from prometheus_client import Counter, Gauge, Histogram
+
+SPAN_QUEUE_DEPTH = Gauge(
+    "fastapi_otel_span_queue_depth",
+    "Number of ended spans waiting in the batch span processor queue",
+    multiprocess_mode="livesum",
+)
+SPANS_DROPPED = Counter(
+    "fastapi_otel_spans_dropped_total",
+    "Total count of spans dropped because the span queue was full",
+)
+EXPORT_BATCH_SIZE = Histogram(
+    "fastapi_otel_export_batch_size",
+    "Histogram of spans per export call",
+    buckets=(1, 8, 32, 64, 128, 256, 512, 1024, 2048),
+)
+EXPORT_DURATION = Histogram(
+    "fastapi_otel_export_duration_seconds",
+    "Histogram of span export duration (in seconds)",
+)
+EXPORT_FAILURES = Counter(
+    "fastapi_otel_export_failures_total",
+    "Total count of failed span export calls",
+)
+
+
+class InstrumentedSpanExporter(SpanExporter):
+    """Span exporter wrapper recording batch size, duration and failures
+
+    ``on_export`` is called before each export, once the batch has left the
+    processor queue.
+    """
+
+    def __init__(
+        self,
+        exporter: SpanExporter,
+        on_export: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.exporter = exporter
+        self.on_export = on_export
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        if self.on_export is not None:
+            self.on_export()
+        EXPORT_BATCH_SIZE.observe(len(spans))
+        before_time = time.perf_counter()
+        try:
+            result = self.exporter.export(spans)
+        except Exception:
+            EXPORT_FAILURES.inc()
+            raise
+        finally:
+            EXPORT_DURATION.observe(time.perf_counter() - before_time)
+        if result is not SpanExportResult.SUCCESS:
+            EXPORT_FAILURES.inc()
+        return result
+
+    def shutdown(self) -> None:
+        self.exporter.shutdown()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self.exporter.force_flush(timeout_millis)
+
+
+class InstrumentedBatchSpanProcessor(BatchSpanProcessor):
+    """BatchSpanProcessor exporting its queue depth and dropped spans.
+
+    ``None`` sizes fall back to the SDK defaults and the ``OTEL_BSP_*`` env vars.
+    The queue depth is set when a span is queued and when a batch leaves the
+    queue, not read at scrape time, so it is also written to the multiprocess
+    files.
+    """
+
+    def __init__(
+        self,
+        span_exporter: SpanExporter,
+        max_queue_size: Optional[int] = None,
+        schedule_delay_millis: Optional[float] = None,
+        max_export_batch_size: Optional[int] = None,
+        export_timeout_millis: Optional[float] = None,
+    ) -> None:
+        super().__init__(
+            InstrumentedSpanExporter(span_exporter, self._set_queue_depth),
+            max_queue_size=max_queue_size,
+            schedule_delay_millis=schedule_delay_millis,
+            max_export_batch_size=max_export_batch_size,
+            export_timeout_millis=export_timeout_millis,
+        )
+
+    def on_end(self, span: ReadableSpan) -> None:
+        # NOTE: the queue is a bounded deque, appending to a full one drops a span
+        if (
+            not self.done
+            and span.context.trace_flags.sampled
+            and len(self.queue) == self.max_queue_size
+        ):
+            SPANS_DROPPED.inc()
+        super().on_end(span)
+        self._set_queue_depth()
+
+    def _set_queue_depth(self) -> None:
+        SPAN_QUEUE_DEPTH.set(len(self.queue))
@@ -0,0 +1,145 @@
+import threading
+import time
+from typing import Mapping, Optional, Sequence
+
+from opentelemetry.context import Context
+from opentelemetry.sdk.trace.sampling import (
+    Decision,
+    ParentBased,
+    Sampler,
+    SamplingResult,
+)
+from opentelemetry.semconv.trace import SpanAttributes
+from opentelemetry.trace import Link, SpanKind, get_current_span
+from opentelemetry.trace.span import TraceState
+from opentelemetry.util.types import Attributes
+from prometheus_client import Gauge
+
+TRACE_ID_LIMIT = (1 << 64) - 1
+
+TRACE_SAMPLING_RATIO = Gauge(
+    "fastapi_trace_sampling_ratio",
+    "Current ratio of root spans sampled by the trace sampler",
+    # NOTE: each worker adapts its own ratio
+    multiprocess_mode="liveall",
+)
+
+
+class PolicySampler(Sampler):
+    """Root span sampler of setting_otlp.
+
+    - ``route_rates`` override the ratio per ``http.route`` (or span name),
+      e.g. ``{"/metrics": 0}`` never samples scrapes
+    - ``ratio`` samples by trace id, like TraceIdRatioBased
+    - ``target_per_second`` turns on the adaptive mode: every
+      ``adjust_interval`` seconds the ratio moves towards
+      ``target_per_second / observed root spans per second``
+    - ``max_per_second`` caps sampled root spans with a token bucket
+    """
+
+    def __init__(
+        self,
+        ratio: float = 1.0,
+        route_rates: Optional[Mapping[str, float]] = None,
+        max_per_second: float = 0.0,
+        target_per_second: float = 0.0,
+        adjust_interval: float = 5.0,
+        min_ratio: float = 0.0001,
+    ) -> None:
+        self.ratio = min(max(ratio, 0.0), 1.0)
+        self.route_rates = dict(route_rates or {})
+        self.max_per_second = max_per_second
+        self.target_per_second = target_per_second
+        self.adjust_interval = adjust_interval
+        self.min_ratio = min_ratio
+        self._lock = threading.Lock()
+        now = time.monotonic()
+        self._tokens = max_per_second
+        self._tokens_at = now
+        self._window_start = now
+        self._window_spans = 0
+        TRACE_SAMPLING_RATIO.set(self.ratio)
+
+    def should_sample(
+        self,
+        parent_context: Optional[Context],
+        trace_id: int,
+        name: str,
+        kind: Optional[SpanKind] = None,
+        attributes: Attributes = None,
+        links: Optional[Sequence[Link]] = None,
+        trace_state: Optional[TraceState] = None,
+    ) -> SamplingResult:
+        route = (attributes or {}).get(SpanAttributes.HTTP_ROUTE, name)
+        ratio = self.route_rates.get(route)
+        if ratio is None:
+            if self.target_per_second:
+                self._adjust()
+            ratio = self.ratio
+
+        sampled = (trace_id & TRACE_ID_LIMIT) < ratio * (TRACE_ID_LIMIT + 1)
+        if sampled and self.max_per_second:
+            sampled = self._take_token()
+
+        trace_state = _parent_trace_state(parent_context)
+        if not sampled:
+            return SamplingResult(Decision.DROP, None, trace_state)
+        return SamplingResult(Decision.RECORD_AND_SAMPLE, attributes, trace_state)
+
+    def _take_token(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.max_per_second,
+                self._tokens + (now - self._tokens_at) * self.max_per_second,
+            )
+            self._tokens_at = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def _adjust(self) -> None:
+        with self._lock:
+            self._window_spans += 1
+            now = time.monotonic()
+            elapsed = now - self._window_start
+            if elapsed < self.adjust_interval:
+                return
+            observed = self._window_spans / elapsed
+            target = min(1.0, max(self.min_ratio, self.target_per_second / observed))
+            # NOTE: smooth the change so one burst does not swing the ratio
+            self.ratio = (self.ratio + target) / 2
+            TRACE_SAMPLING_RATIO.set(self.ratio)
+            self._window_start, self._window_spans = now, 0
+
+    def get_description(self) -> str:
+        return (
+            f"PolicySampler{{ratio={self.ratio}, routes={self.route_rates}, "
+            f"max_per_second={self.max_per_second}, "
+            f"target_per_second={self.target_per_second}}}"
+        )
+
+
+def _parent_trace_state(parent_context: Optional[Context]) -> Optional[TraceState]:
+    span_context = get_current_span(parent_context).get_span_context()
+    if span_context is None or not span_context.is_valid:
+        return None
+    return span_context.trace_state
+
+
+def build_sampler(
+    ratio: float = 1.0,
+    route_rates: Optional[Mapping[str, float]] = None,
+    max_per_second: float = 0.0,
+    target_per_second: float = 0.0,
+) -> Sampler:
+    """Parent-based sampler: follow the caller's decision, else apply the policy"""
+    return ParentBased(
+        root=PolicySampler(
+            ratio=ratio,
+            route_rates=route_rates,
+            max_per_second=max_per_second,
+            target_per_second=target_per_second,
+        )
+    )
@@ -1,65 +1,182 @@
-import json
 import logging
 import math
 import time
-from copy import deepcopy
 from datetime import datetime
 from http import HTTPStatus
 from logging.config import dictConfig
-from typing import ClassVar
-from uuid import uuid4
+from tempfile import SpooledTemporaryFile
+from types import SimpleNamespace
+from typing import List, Mapping, Optional, Sequence
 
-from fastapi import Request, Response
-
-# from starlette.background import BackgroundTasks
-from starlette.middleware.base import RequestResponseEndpoint
-from starlette.types import Receive
+import anyio
+from fastapi import Request
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 # TODO
 # from user_agents import parse
-from fastapi_app.core.globals import g
+from fastapi_app.core.globals import get_trace_id, request_global
+from fastapi_app.core.log_sampling import LOG_SAMPLER, LogSampler, LogSamplingFilter
 from fastapi_app.core.logging_config import LOG_CONFIG
-from fastapi_app.core.logging_constant import EMPTY_VALUE, PASS_ROUTES
+from fastapi_app.core.logging_constant import (
+    EMPTY_VALUE,
+    PASS_ROUTES,
+    REQUEST_BODY_LIMITS,
+    RESPONSE_BODY_LIMITS,
+)
+from fastapi_app.core.logging_queue import enable_async_logging
 from fastapi_app.core.logging_schema import RequestJSONLogSchema
+from fastapi_app.core.redaction import (
+    REDACTION_POLICY,
+    RedactionPolicy,
+    split_names,
+)
 from fastapi_app.core.settings import settings
 
 
-class ReceiveProxy:
-    """Proxy to starlette.types.Receive.__call__ with caching first receive call.
-    https://github.com/tiangolo/fastapi/issues/394#issuecomment-994665859
+dictConfig(LOG_CONFIG)
+
+if LOG_SAMPLER is not None:
+    for logger_name in LOG_CONFIG["loggers"]:
+        logging.getLogger(logger_name).addFilter(LogSamplingFilter(LOG_SAMPLER))
+
+LOG_LISTENER = (
+    enable_async_logging(
+        LOG_CONFIG["loggers"],
+        maxsize=settings.LOG_QUEUE_SIZE,
+        overflow=settings.LOG_QUEUE_OVERFLOW,
+    )
+    if settings.LOG_ASYNC
+    else None
+)
+
+# NOTE: "main" 指向 LOG_CONFIG["loggers"]["main"]
+logger = logging.getLogger("main")
+
+
+class BodyCapture:
+    """Tee of a body stream: counts every byte but keeps at most ``limit`` bytes.
+
+    A body over the limit keeps only its size and the truncation flag, or its
+    first ``limit`` bytes with ``keep_prefix``. ``limit=0`` (binary content
+    types) keeps nothing.
     """
 
-    receive: Receive
-    cached_body: bytes
-    _is_first_call: ClassVar[bool] = True
+    __slots__ = ("limit", "keep_prefix", "size", "chunks", "truncated")
 
-    async def __call__(self):
-        # First call will be for getting request body => returns cached result
-        if self._is_first_call:
-            self._is_first_call = False
-            return {
-                "type": "http.request",
-                "body": self.cached_body,
-                "more_body": False,
-            }
+    def __init__(self, limit: int = 0, keep_prefix: bool = False) -> None:
+        self.limit = limit
+        self.keep_prefix = keep_prefix
+        self.size = 0
+        self.chunks: List[bytes] = []
+        self.truncated = False
 
-        return await self.receive()
+    def feed(self, chunk: bytes) -> None:
+        kept = self.size
+        self.size += len(chunk)
+        if not self.limit or self.truncated:
+            return
+        if self.size > self.limit:
+            self.truncated = True
+            if self.keep_prefix:
+                self.chunks.append(chunk[: self.limit - kept])
+            else:
+                self.chunks = []
+        else:
+            self.chunks.append(chunk)
 
+    @property
+    def text(self) -> Optional[str]:
+        if not self.limit or (self.truncated and not self.keep_prefix):
+            return None
+        return b"".join(self.chunks).decode("utf-8", errors="replace")
 
-dictConfig(LOG_CONFIG)
 
-# NOTE: "main" 指向 LOG_CONFIG["loggers"]["main"]
-logger = logging.getLogger("main")
+class ReceiveCapture:
+    """Wrapper of ``receive`` teeing request body chunks while the app reads them.
+
+    Chunks reach the app as they arrive: ``body`` keeps a prefix for the log
+    and ``spill`` (when full capture is enabled) the whole body, in memory up
+    to ``spill_size`` then in a temp file. Once the body passes ``spill_size``
+    it is written from a worker thread, never on the event loop.
+    """
+
+    __slots__ = ("receive", "body", "spill", "spill_size", "spilled")
+
+    def __init__(
+        self,
+        receive: Receive,
+        body: BodyCapture,
+        spill: Optional[SpooledTemporaryFile] = None,
+        spill_size: int = 0,
+    ) -> None:
+        self.receive = receive
+        self.body = body
+        self.spill = spill
+        self.spill_size = spill_size
+        self.spilled = 0
+
+    async def __call__(self) -> Message:
+        message = await self.receive()
+        if message["type"] == "http.request":
+            chunk = message.get("body", b"")
+            self.body.feed(chunk)
+            if self.spill is not None:
+                self.spilled += len(chunk)
+                if self.spilled > self.spill_size:
+                    # NOTE: this write rolls the spool over to disk or it is
+                    # on disk already
+                    await anyio.to_thread.run_sync(self.spill.write, chunk)
+                else:
+                    self.spill.write(chunk)
+                if not message.get("more_body", False):
+                    self.spill.seek(0)
+        return message
+
+
+def body_limit(content_type: str, limits: Mapping[str, int]) -> int:
+    content_type = content_type.split(";", 1)[0].strip().lower()
+    for prefix, limit in limits.items():
+        if content_type.startswith(prefix):
+            return limit
+    return 0
 
 
 class UltimateLoggingMiddleware:
-    """Middleware that saves logs to JSON
-    The main problem is
-    After getting request_body
-        body = await request.body()
-    Body is removed from requests. I found solution as ReceiveProxy
+    """Pure ASGI middleware that saves logs to JSON
+
+    Response chunks are sent to the client as they arrive while a bounded
+    prefix is kept for the log (see ``RESPONSE_BODY_LIMITS``), so streaming,
+    SSE and file downloads are left untouched. The log entry is written once
+    the final ``http.response.body`` message has been sent. Request bodies
+    are captured the same way while the app reads them, only for the content
+    types of ``request_body_limits`` and paths starting with one of
+    ``request_body_routes`` (all paths when empty). Logged headers and bodies
+    go through ``redaction`` (see ``core/redaction.py``).
     """
 
+    def __init__(
+        self,
+        app: ASGIApp,
+        body_limits: Mapping[str, int] = RESPONSE_BODY_LIMITS,
+        sampler: Optional[LogSampler] = LOG_SAMPLER,
+        redaction: RedactionPolicy = REDACTION_POLICY,
+        request_body_limits: Mapping[str, int] = REQUEST_BODY_LIMITS,
+        request_body_routes: Sequence[str] = tuple(
+            split_names(settings.LOG_REQUEST_BODY_ROUTES)
+        ),
+        full_request_body: bool = settings.LOG_REQUEST_BODY_FULL,
+        spill_size: int = settings.LOG_REQUEST_BODY_SPILL_SIZE,
+    ) -> None:
+        self.app = app
+        self.body_limits = body_limits
+        self.sampler = sampler
+        self.redaction = redaction
+        self.request_body_limits = request_body_limits
+        self.request_body_routes = tuple(request_body_routes)
+        self.full_request_body = full_request_body
+        self.spill_size = spill_size
+
     @staticmethod
     async def get_protocol(request: Request) -> str:
         protocol = str(request.scope.get("type", ""))
@@ -68,100 +185,109 @@ class UltimateLoggingMiddleware:
             return f"{protocol.upper()}/{http_version}"
         return EMPTY_VALUE
 
-    async def get_request_body(self, request: Request) -> bytes:
-        body = await request.body()
-
-        request._receive = ReceiveProxy(receive=request.receive, cached_body=body)
-        return body
-
-    def filter_header_and_body(
-        self,
-        request_headers: dict,
-        response_body,
-    ) -> tuple:
-        # body = json.loads(response_body)
-        # if body and body.get("data"):
-        #     del body["data"]
-        # headers = deepcopy(request_headers)
-        # headers.pop("cookie", None)
-        # if headers.get("authorization"):
-        #     headers.update({"authorization": "****"})
-        # return headers, body
-
-        if isinstance(response_body, dict):
-            body = json.loads(response_body)
-            if "data" in body:
-                body.pop("data")
-        else:
-            body = response_body
-
-        headers = deepcopy(request_headers)
-
-        headers.pop("cookie", None)
+    def request_body_limit(self, scope: Scope) -> int:
+        if self.request_body_routes and not scope["path"].startswith(
+            self.request_body_routes
+        ):
+            return 0
+        content_type = Headers(scope=scope).get("content-type", EMPTY_VALUE)
+        return body_limit(content_type, self.request_body_limits)
 
-        if "authorization" in headers:
-            headers["authorization"] = "****"
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-        return headers, body
+        # pass /api/v1/openapi.json, /api/v1/docs, /api/v1/redoc, /api/v1/healthcheck
+        if scope["path"] in PASS_ROUTES or scope["path"].endswith(".worker.js.map"):
+            await self.app(scope, receive, send)
+            return
 
-    async def __call__(
-        self,
-        request: Request,
-        call_next: RequestResponseEndpoint,
-        *args,
-        **kwargs,
-    ):
         # logger.debug(f"Started Middleware: {__name__}")
         start_time = time.time()
-        exception_object = None
-        state = request.state.__dict__.get("_state")
-        if state.get("trace_id", None) is None:
-            request.state.trace_id = uuid4().hex
-        g.trace_id = request.state.trace_id
-        # NOTE: Ignore when requesting static resources
-        # request_body = await self.get_request_body(request)
-        server: tuple = request.get("server", ("localhost", settings.PORT))
-        client: tuple = request.get("client", ("localhost", settings.PORT))
-        request_headers: dict = dict(request.headers.items())
+        # NOTE: per request context, the trace id comes from the active span
+        # unless one was set on the request state
+        state = scope.setdefault("state", {})
+        token = request_global.set(
+            SimpleNamespace(trace_id=state.get("trace_id"), start_time=start_time)
+        )
+        request_body = BodyCapture(self.request_body_limit(scope), keep_prefix=True)
+        spill = None
+        if request_body.limit:
+            if self.full_request_body:
+                spill = state["request_body_file"] = SpooledTemporaryFile(
+                    max_size=self.spill_size
+                )
+            receive = ReceiveCapture(receive, request_body, spill, self.spill_size)
+        request = Request(scope, receive)
+        response_start: Message = {}
+        response_body = BodyCapture()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_start, response_body
+            if message["type"] == "http.response.start":
+                response_start = message
+                content_type = Headers(raw=message.get("headers", [])).get(
+                    "content-type", EMPTY_VALUE
+                )
+                response_body = BodyCapture(body_limit(content_type, self.body_limits))
+                await send(message)
+            elif message["type"] == "http.response.body":
+                response_body.feed(message.get("body", b""))
+                await send(message)
+                if not message.get("more_body", False):
+                    await self.log_response(
+                        request,
+                        start_time,
+                        request_body,
+                        response_start,
+                        response_body,
+                    )
+            else:
+                await send(message)
 
         # Response Side
         try:
-            response = await call_next(request)
+            await self.app(scope, receive, send_wrapper)
         except Exception as ex:
-            # response_body = bytes(http.HTTPStatus.INTERNAL_SERVER_ERROR.phrase.encode())
-            # response = Response(
-            #     content=response_body,
-            #     status_code=http.HTTPStatus.INTERNAL_SERVER_ERROR.real,
-            # )
             exception_object = ex  # noqa
-            # response_headers = {}
             # NOTE: JSONLogFormatter.format -> JSONLogFormatter._format_log_object line281 record.exc_info -> print to stdout
             logger.error(msg=f"Exception: {ex}", exc_info=exception_object)
             # OPTIMIZE: https://martinheinz.dev/blog/66
             # stackprinter.show()
-            # return response
             raise ex
-        else:
-            response_headers = dict(response.headers.items())
-            response_body = b""
-
-            async for chunk in response.body_iterator:
-                response_body += chunk
+        finally:
+            request_global.reset(token)
+            if spill is not None:
+                spill.close()
 
-            response = Response(
-                content=response_body,
-                status_code=response.status_code,
-                headers=dict(response.headers),
-                media_type=response.media_type,
+    async def log_response(
+        self,
+        request: Request,
+        start_time: float,
+        request_body: BodyCapture,
+        response_start: Message,
+        response_body: BodyCapture,
+    ) -> None:
+        duration: int = math.ceil((time.time() - start_time) * 1000)
+        status_code: int = response_start.get("status", 500)
+        extra = {}
+        if self.sampler is not None:
+            # NOTE: decide before building any JSON, routes are matched by template
+            route = request.scope.get("route")
+            sample_weight = self.sampler.weight(
+                logging.INFO,
+                route=getattr(route, "path", request.url.path),
+                status_code=status_code,
+                duration=duration,
             )
+            if not sample_weight:
+                return
+            extra["sample_weight"] = sample_weight
 
-        # pass /api/v1/openapi.json, /api/v1/docs, /api/v1/redoc, /api/v1/healthcheck
-        if request.url.path in PASS_ROUTES or request.url.path.endswith(
-            ".worker.js.map"
-        ):
-            return response
-
-        duration: int = math.ceil((time.time() - start_time) * 1000)
+        server: tuple = request.get("server") or ("localhost", settings.PORT)
+        # NOTE: Headers.get decodes only the matching value
+        request_headers = request.headers
 
         # Initializing of json fields
         request_json_fields = RequestJSONLogSchema(
@@ -171,44 +297,43 @@ class UltimateLoggingMiddleware:
             request_method=request.method,
             request_path=request.url.path,
             request_host=f"{server[0]}:{server[1]}",
-            request_size=int(request_headers.get("content-length", 0)),
+            request_size=int(request_headers.get("content-length", 0))
+            or request_body.size,
             request_content_type=request_headers.get("content-type", EMPTY_VALUE),
-            request_headers=request_headers,
-            # request_body=request_body,
+            request_headers=self.redaction.headers(request.scope["headers"]),
+            request_body=self.redaction.body(request_body.text),
+            request_body_truncated=request_body.truncated,
             request_direction="in",
             # Response side
-            response_status_code=response.status_code,
-            response_size=int(response_headers.get("content-length", 0)),
-            response_headers=response_headers,
-            response_body=response_body,
+            response_status_code=status_code,
+            response_size=response_body.size,
+            response_headers=self.redaction.headers(
+                response_start.get("headers", [])
+            ),
+            response_body=self.redaction.body(response_body.text),
+            response_body_truncated=response_body.truncated,
             duration=duration,
         ).model_dump()
 
-        headers, body = self.filter_header_and_body(request_headers, response_body)
         # NOTE: add other logic
 
-        # tasks = BackgroundTasks()
-        # tasks.add_task()
-        # response.background = tasks
-        # message = (
-        #     f'{"Error" if exception_object else "Answer"} '
-        #     f"code: {response.status_code} "
-        #     f'request url: {request.method} "{str(request.url)}" '
-        #     f"duration: {duration} ms "
-        # )
-        timestamp = datetime.fromtimestamp(request.state.start_time).strftime(
+        timestamp = datetime.fromtimestamp(start_time).strftime(
             "%Y-%m-%dT%H:%M:%S.%f%z"
         )
         method = request.method
         url = str(request.url)
         method_place = f"{method}{' ' * (7 - len(method))}"
         protocol = await UltimateLoggingMiddleware.get_protocol(request)
-        client = f"{request.client.host}:{request.client.port}"
+        client = (
+            f"{request.client.host}:{request.client.port}"
+            if request.client
+            else EMPTY_VALUE
+        )
         # INFO     127.0.0.1:59354 - 2024-03-07T18:39:45.425493 77cec0c1556f4a2998a8a01a13ecb6a7 "POST   http://localhost:8000/api/v1/auth/login HTTP/1.1" 200 "OK" 60ms
         message = (
-            f'{client} - {timestamp} {request.state.trace_id} "{method_place}{url} {protocol}"'
-            f" {response.status_code}"
-            f' "{HTTPStatus(response.status_code).phrase}"'
+            f'{client} - {timestamp} {get_trace_id()} "{method_place}{url} {protocol}"'
+            f" {status_code}"
+            f' "{HTTPStatus(status_code).phrase}"'
             f" {duration}ms"
         )
         logger.info(
@@ -217,7 +342,7 @@ class UltimateLoggingMiddleware:
                 # NOTE: Injected into format(record: logging.LogRecord) method of the Formatter class
                 "request_json_fields": request_json_fields,
                 "to_mask": True,
+                **extra,
             },
             # exc_info=exception_object,
         )
-        return response
@@ -0,0 +1,265 @@
+import logging
+import time
+from typing import AsyncIterator, Callable, Dict, Mapping, NamedTuple, Optional, Tuple
+
+import httpx
+from opentelemetry import trace
+from opentelemetry.propagate import inject
+from opentelemetry.semconv.trace import SpanAttributes
+from opentelemetry.trace import Span, SpanKind, StatusCode
+from prometheus_client import Counter, Gauge, Histogram
+from starlette.requests import Request
+
+from fastapi_app.core.multiprocess import IN_PROGRESS_MULTIPROCESS_MODE
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_REQUEST_DURATION = Histogram(
+    "fastapi_upstream_request_duration_seconds",
+    "Histogram of outbound request duration by upstream, method and status code (in seconds)",
+    ["upstream", "method", "status_code"],
+)
+UPSTREAM_REQUESTS_IN_FLIGHT = Gauge(
+    "fastapi_upstream_requests_in_flight",
+    "Gauge of outbound requests by upstream not completed yet",
+    ["upstream"],
+    multiprocess_mode=IN_PROGRESS_MULTIPROCESS_MODE,
+)
+UPSTREAM_POOL_WAIT = Histogram(
+    "fastapi_upstream_pool_wait_seconds",
+    "Histogram of time spent waiting for a pooled connection by upstream (in seconds)",
+    ["upstream"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+UPSTREAM_ERRORS = Counter(
+    "fastapi_upstream_errors_total",
+    "Total count of failed outbound requests by upstream and error type",
+    ["upstream", "error_type"],
+)
+
+# NOTE: httpcore trace events, the first one seen means a connection was acquired
+CONNECTION_ACQUIRED_EVENTS = (
+    "connection.connect_tcp.started",
+    "http11.send_request_headers.started",
+    "http2.send_request_headers.started",
+)
+
+
+class UpstreamConfig(NamedTuple):
+    base_url: str
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 5.0
+    connect_timeout: float = 5.0
+    read_timeout: float = 10.0
+    pool_timeout: float = 5.0
+    http2: bool = False
+
+
+class _Exchange:
+    """Bookkeeping of one outbound request until its response body is closed"""
+
+    __slots__ = ("transport", "method", "start", "span", "status_code", "done")
+
+    def __init__(
+        self, transport: "InstrumentedTransport", method: str, span: Span
+    ) -> None:
+        self.transport = transport
+        self.method = method
+        self.start = time.perf_counter()
+        self.span = span
+        self.status_code: Optional[int] = None
+        self.done = False
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        if self.done:
+            return
+        self.done = True
+        transport = self.transport
+        transport.in_flight.dec()
+        if error is not None:
+            transport.errors(type(error).__name__).inc()
+            self.span.record_exception(error)
+            self.span.set_status(StatusCode.ERROR, type(error).__name__)
+        if self.status_code is not None:
+            transport.duration(self.method, self.status_code).observe(
+                time.perf_counter() - self.start
+            )
+        self.span.end()
+
+
+class InstrumentedStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, exchange: _Exchange) -> None:
+        self.stream = stream
+        self.exchange = exchange
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self.stream:
+                yield chunk
+        except BaseException as error:
+            self.exchange.finish(error)
+            raise
+
+    async def aclose(self) -> None:
+        try:
+            await self.stream.aclose()
+        finally:
+            self.exchange.finish()
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Wrap a pooled transport with metrics, a client span and trace propagation.
+
+    - the W3C trace context of a CLIENT span is injected in the request headers
+    - pool wait is the time until httpcore connects or sends on a connection
+    - duration and in-flight cover the whole exchange, until the response
+      body is closed (``AsyncClient`` closes it once read)
+    - errors are counted by exception type, e.g. ``ConnectError``, ``PoolTimeout``
+    """
+
+    def __init__(self, upstream: str, transport: httpx.AsyncBaseTransport) -> None:
+        self.upstream = upstream
+        self.transport = transport
+        self.tracer = trace.get_tracer(__name__)
+        self.in_flight = UPSTREAM_REQUESTS_IN_FLIGHT.labels(upstream=upstream)
+        self.pool_wait = UPSTREAM_POOL_WAIT.labels(upstream=upstream)
+        self._durations: Dict[Tuple[str, int], Histogram] = {}
+        self._errors: Dict[str, Counter] = {}
+
+    def duration(self, method: str, status_code: int) -> Histogram:
+        child = self._durations.get((method, status_code))
+        if child is None:
+            child = self._durations[(method, status_code)] = (
+                UPSTREAM_REQUEST_DURATION.labels(
+                    upstream=self.upstream, method=method, status_code=status_code
+                )
+            )
+        return child
+
+    def errors(self, error_type: str) -> Counter:
+        child = self._errors.get(error_type)
+        if child is None:
+            child = self._errors[error_type] = UPSTREAM_ERRORS.labels(
+                upstream=self.upstream, error_type=error_type
+            )
+        return child
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        span = self.tracer.start_span(
+            f"{request.method} {self.upstream}",
+            kind=SpanKind.CLIENT,
+            attributes={
+                SpanAttributes.HTTP_METHOD: request.method,
+                SpanAttributes.HTTP_URL: str(request.url),
+                SpanAttributes.NET_PEER_NAME: request.url.host,
+            },
+        )
+        inject(request.headers, context=trace.set_span_in_context(span))
+        exchange = _Exchange(self, request.method, span)
+        request.extensions = {
+            **request.extensions,
+            "trace": self._trace_callback(exchange, request.extensions.get("trace")),
+        }
+        self.in_flight.inc()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except BaseException as error:
+            exchange.finish(error)
+            raise
+        exchange.status_code = response.status_code
+        span.set_attribute(SpanAttributes.HTTP_STATUS_CODE, response.status_code)
+        if response.status_code >= 500:
+            span.set_status(StatusCode.ERROR)
+        response.stream = InstrumentedStream(response.stream, exchange)
+        return response
+
+    def _trace_callback(
+        self, exchange: _Exchange, chained: Optional[Callable] = None
+    ) -> Callable:
+        acquired = False
+
+        async def callback(event: str, info: dict) -> None:
+            nonlocal acquired
+            if not acquired and event in CONNECTION_ACQUIRED_EVENTS:
+                acquired = True
+                self.pool_wait.observe(time.perf_counter() - exchange.start)
+            if chained is not None:
+                await chained(event, info)
+
+        return callback
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def build_client(name: str, config: UpstreamConfig) -> httpx.AsyncClient:
+    http2 = config.http2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning(
+                "HTTP/2 for upstream %s needs the h2 package (httpx[http2]), "
+                "falling back to HTTP/1.1",
+                name,
+            )
+            http2 = False
+    transport = httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry,
+        ),
+        http2=http2,
+    )
+    return httpx.AsyncClient(
+        base_url=config.base_url,
+        transport=InstrumentedTransport(name, transport),
+        timeout=httpx.Timeout(
+            config.read_timeout,
+            connect=config.connect_timeout,
+            pool=config.pool_timeout,
+        ),
+    )
+
+
+class UpstreamClients:
+    """One pooled ``httpx.AsyncClient`` per upstream, tied to the app lifespan.
+
+    ``setup`` opens the clients on startup, closes them on shutdown and
+    exposes them as ``app.state.upstreams``; handlers get one with
+    ``Depends(upstream_client("name"))`` or ``request.app.state.upstreams["name"]``.
+    """
+
+    def __init__(self, upstreams: Mapping[str, UpstreamConfig]) -> None:
+        self.upstreams = dict(upstreams)
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+
+    def setup(self, app) -> None:
+        app.state.upstreams = self
+        app.add_event_handler("startup", self.start)
+        app.add_event_handler("shutdown", self.aclose)
+
+    async def start(self) -> None:
+        for name, config in self.upstreams.items():
+            if name not in self.clients:
+                self.clients[name] = build_client(name, config)
+
+    async def aclose(self) -> None:
+        clients, self.clients = self.clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    def __getitem__(self, name: str) -> httpx.AsyncClient:
+        client = self.clients.get(name)
+        if client is None:
+            raise KeyError(f"Upstream {name!r} is not configured or not started")
+        return client
+
+
+def upstream_client(name: str) -> Callable[[Request], httpx.AsyncClient]:
+    def dependency(request: Request) -> httpx.AsyncClient:
+        return request.app.state.upstreams[name]
+
+    return dependency
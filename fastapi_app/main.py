@@ -5,11 +5,18 @@ import os
 # from typing import Callable
 # from uuid import uuid4
 import uvicorn
-from fastapi import FastAPI
-
-# from opentelemetry.propagate import inject
-# from fastapi_app.core.ultimate_logging import UltimateLoggingMiddleware
-from utils import PrometheusMiddleware, is_running_in_docker, metrics, setting_otlp
+from fastapi import FastAPI, Request
+
+from fastapi_app.core.parsing import parse_rates
+from fastapi_app.core.trace_sampling import build_sampler
+from fastapi_app.utils import (
+    PrometheusMiddleware,
+    is_running_in_docker,
+    latency_stats,
+    metrics,
+    setting_otlp,
+    setting_otlp_metrics,
+)
 
 APP_NAME = os.environ.get("APP_NAME", "app")
 EXPOSE_PORT = os.environ.get("EXPOSE_PORT", 8000)
@@ -19,17 +26,145 @@ OTLP_GRPC_ENDPOINT = os.environ.get(
     "http://tempo:4317" if is_running_in_docker() else "http://localhost:4317",
 )
 
+# NOTE: without tracing the OTLP exporter and instrumentations are not imported
+TRACING_ENABLE = os.environ.get("TRACING_ENABLE", "true") == "true"
+
+# NOTE: parent-based sampling of root spans, TRACE_SAMPLE_TARGET_PER_SECOND
+# enables the adaptive mode, route rates of 0 never sample the route
+TRACE_SAMPLER = build_sampler(
+    ratio=float(os.environ.get("TRACE_SAMPLE_RATIO", 1.0)),
+    route_rates=parse_rates(os.environ.get("TRACE_SAMPLE_ROUTE_RATES", "/metrics=0")),
+    max_per_second=float(os.environ.get("TRACE_SAMPLE_MAX_PER_SECOND", 0)),
+    target_per_second=float(os.environ.get("TRACE_SAMPLE_TARGET_PER_SECOND", 0)),
+)
+
+# NOTE: push the request metrics over OTLP (delta temporality) to the same
+# endpoint, e.g. for short-lived workers that are never scraped
+OTLP_METRICS_ENABLE = os.environ.get("OTLP_METRICS_ENABLE", "false") == "true"
+OTLP_METRICS_EXPORT_INTERVAL_MILLIS = float(
+    os.environ.get("OTLP_METRICS_EXPORT_INTERVAL_MILLIS", 10000)
+)
+OTLP_METRICS_MAX_EXPORT_BATCH_SIZE = int(
+    os.environ.get("OTLP_METRICS_MAX_EXPORT_BATCH_SIZE", 1000)
+)
+
+# NOTE: without upstreams httpx and the upstream client instrumentation are
+# not imported and /chain is not served
+UPSTREAMS_ENABLE = os.environ.get("UPSTREAMS_ENABLE", "true") == "true"
 TARGET_ONE_HOST = os.environ.get("TARGET_ONE_HOST", "app-b")
 TARGET_TWO_HOST = os.environ.get("TARGET_TWO_HOST", "app-c")
 
-app = FastAPI()
+# NOTE: pool limits and timeouts shared by the upstream clients, trace
+# context is injected by their transport
+UPSTREAM_OPTIONS = dict(
+    max_connections=int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", 100)),
+    max_keepalive_connections=int(
+        os.environ.get("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", 20)
+    ),
+    keepalive_expiry=float(os.environ.get("UPSTREAM_KEEPALIVE_EXPIRY", 5.0)),
+    connect_timeout=float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", 5.0)),
+    read_timeout=float(os.environ.get("UPSTREAM_READ_TIMEOUT", 10.0)),
+    pool_timeout=float(os.environ.get("UPSTREAM_POOL_TIMEOUT", 5.0)),
+    http2=os.environ.get("UPSTREAM_HTTP2", "false") == "true",
+)
+UPSTREAM_URLS = {
+    "target_one": f"http://{TARGET_ONE_HOST}:8000",
+    "target_two": f"http://{TARGET_TWO_HOST}:8000",
+}
 
-# Setting metrics middleware
-app.add_middleware(PrometheusMiddleware, app_name=APP_NAME)
-app.add_route("/metrics", metrics)
 
-# Setting OpenTelemetry exporter
-setting_otlp(app, APP_NAME, OTLP_GRPC_ENDPOINT)
+async def root():
+    logging.info("root endpoint")
+    app_message = os.environ.get("APP_MESSAGE", "Hello")
+
+    return {"message": app_message}
+
+
+async def chain(request: Request):
+    upstreams = request.app.state.upstreams
+    for name in UPSTREAM_URLS:
+        response = await upstreams[name].get("/")
+        response.raise_for_status()
+    logging.info("chain finished")
+    return {"path": "/chain"}
+
+
+def create_app(
+    prometheus: bool = True,
+    tracing: bool = True,
+    log_correlation: bool = True,
+    ultimate_logging: bool = False,
+    otlp_metrics: bool = False,
+    upstreams: bool = True,
+) -> FastAPI:
+    """Build the app, each observability layer can be turned off (see benchmarks/)"""
+    app = FastAPI()
+
+    # Setting metrics middleware
+    request_metrics = None
+    if otlp_metrics:
+        request_metrics = setting_otlp_metrics(
+            app,
+            APP_NAME,
+            OTLP_GRPC_ENDPOINT,
+            export_interval_millis=OTLP_METRICS_EXPORT_INTERVAL_MILLIS,
+            max_export_batch_size=OTLP_METRICS_MAX_EXPORT_BATCH_SIZE,
+        )
+    if prometheus or otlp_metrics:
+        app.add_middleware(
+            PrometheusMiddleware, app_name=APP_NAME, otlp_metrics=request_metrics
+        )
+    if prometheus:
+        app.add_route("/metrics", metrics)
+        app.add_route("/metrics/latency", latency_stats)
+
+    if ultimate_logging:
+        # NOTE: imported lazily, it configures logging on import
+        from fastapi_app.core.ultimate_logging import (
+            LOG_LISTENER,
+            UltimateLoggingMiddleware,
+        )
+
+        app.add_middleware(UltimateLoggingMiddleware)
+        if LOG_LISTENER is not None:
+            LOG_LISTENER.setup(app)
+
+    # Setting OpenTelemetry exporter
+    if tracing:
+        setting_otlp(
+            app,
+            APP_NAME,
+            OTLP_GRPC_ENDPOINT,
+            log_correlation=log_correlation,
+            sampler=TRACE_SAMPLER,
+        )
+    elif log_correlation:
+        from opentelemetry.instrumentation.logging import LoggingInstrumentor
+
+        LoggingInstrumentor().instrument(set_logging_format=True)
+
+    app.add_api_route("/", root, methods=["GET"])
+
+    if upstreams:
+        from fastapi_app.core.upstream import UpstreamClients, UpstreamConfig
+
+        # NOTE: clients are opened and closed with the app lifespan
+        UpstreamClients(
+            {
+                name: UpstreamConfig(url, **UPSTREAM_OPTIONS)
+                for name, url in UPSTREAM_URLS.items()
+            }
+        ).setup(app)
+        app.add_api_route("/chain", chain, methods=["GET"])
+    return app
+
+
+app = create_app(
+    tracing=TRACING_ENABLE,
+    log_correlation=TRACING_ENABLE,
+    otlp_metrics=OTLP_METRICS_ENABLE,
+    upstreams=UPSTREAMS_ENABLE,
+)
 
 
 class EndpointFilter(logging.Filter):
@@ -41,9 +176,6 @@ class EndpointFilter(logging.Filter):
 # Filter out /endpoint
 logging.getLogger("uvicorn.access").addFilter(EndpointFilter())
 
-# TODO
-# app.middleware("http")(UltimateLoggingMiddleware())
-
 # @app.middleware("http")
 # async def set_process_time_header(request: Request, call_next: Callable):
 #     start_time = time.time()
@@ -64,14 +196,6 @@ logging.getLogger("uvicorn.access").addFilter(EndpointFilter())
 #     return response
 
 
-@app.get("/")
-async def root():
-    logging.info("root endpoint")
-    app_message = os.environ.get("APP_MESSAGE", "Hello")
-
-    return {"message": app_message}
-
-
 if __name__ == "__main__":
     """
     asctime: The time of creation of the LogRecord (formatted as "2003-07-08 16:49:45,896")
@@ -98,9 +222,10 @@ if __name__ == "__main__":
     # log_config["formatters"]["access"]["fmt"] = (
     #     "%(asctime)s %(levelname)s [%(name)s] [%(filename)s:%(lineno)d] - %(message)s"
     # )
-    # NOTE: "main:app" 或 "fastapi_app.main:app" 都可以
+    # NOTE: run from the repo root (python -m fastapi_app.main), fastapi_app is
+    # the import root of the app and its core modules
     uvicorn.run(
-        "main:app",
+        "fastapi_app.main:app",
         host="0.0.0.0",
         port=8000,
         reload=True,
@@ -1,27 +1,50 @@
+import atexit
+import os
 import re
 import time
-from typing import Tuple
+from typing import Collection, Dict, Mapping, Optional, Tuple
 
 from opentelemetry import trace
-from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
-from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
-from opentelemetry.instrumentation.logging import LoggingInstrumentor
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import Sampler
 from prometheus_client import REGISTRY, Counter, Gauge, Histogram
-from prometheus_client.openmetrics.exposition import (
-    CONTENT_TYPE_LATEST,
-    generate_latest,
-)
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from prometheus_client.openmetrics.exposition import CONTENT_TYPE_LATEST
 from starlette.requests import Request
-from starlette.responses import Response
-from starlette.routing import Match
+from starlette.responses import JSONResponse, Response
 from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR
-from starlette.types import ASGIApp
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from fastapi_app.core.cardinality import NO_GUARD, CardinalityGuard
+from fastapi_app.core.exp_histogram import (
+    CLASSIC_EXPONENTS,
+    ExponentialHistogram,
+    exponential_bounds,
+)
+from fastapi_app.core.exposition import (
+    IDENTITY,
+    PROTOBUF,
+    ExpositionCache,
+    negotiate_encoding,
+    negotiate_format,
+)
+from fastapi_app.core.multiprocess import (
+    IN_PROGRESS_MULTIPROCESS_MODE,
+    MULTIPROC_DIR,
+    collect_multiprocess,
+    is_multiprocess_mode,
+)
+from fastapi_app.core.otlp_metrics import OTLPMetrics
+from fastapi_app.core.protobuf_exposition import CONTENT_TYPE_PROTOBUF
+from fastapi_app.core.quantile_sketch import LatencySketches
+from fastapi_app.core.route_resolver import RouteResolver
 
-INFO = Gauge("fastapi_app_info", "FastAPI application information.", ["app_name"])
+INFO = Gauge(
+    "fastapi_app_info",
+    "FastAPI application information.",
+    ["app_name"],
+    multiprocess_mode="livemax",
+)
 REQUESTS = Counter(
     "fastapi_requests_total",
     "Total count of requests by method and path.",
@@ -32,11 +55,32 @@ RESPONSES = Counter(
     "Total count of responses by method, path and status codes.",
     ["method", "path", "status_code", "app_name"],
 )
-REQUESTS_PROCESSING_TIME = Histogram(
-    "fastapi_requests_duration_seconds",
-    "Histogram of requests processing time by path (in seconds)",
-    ["method", "path", "app_name"],
-)
+# NOTE: sparse exponential buckets (native histogram, down-sampled to one
+# classic bucket per power of two for text scrapes) instead of the defaults
+EXPONENTIAL_HISTOGRAM = os.environ.get("PROMETHEUS_EXPONENTIAL_HISTOGRAM") == "true"
+if EXPONENTIAL_HISTOGRAM and not is_multiprocess_mode():
+    REQUESTS_PROCESSING_TIME = ExponentialHistogram(
+        "fastapi_requests_duration_seconds",
+        "Histogram of requests processing time by path (in seconds)",
+        ["method", "path", "app_name"],
+        schema=int(os.environ.get("PROMETHEUS_HISTOGRAM_SCHEMA", 3)),
+        max_buckets=int(os.environ.get("PROMETHEUS_HISTOGRAM_MAX_BUCKETS", 160)),
+    )
+elif EXPONENTIAL_HISTOGRAM:
+    # NOTE: native buckets cannot be merged through the mmap files, workers
+    # share the classic down-sampled buckets only
+    REQUESTS_PROCESSING_TIME = Histogram(
+        "fastapi_requests_duration_seconds",
+        "Histogram of requests processing time by path (in seconds)",
+        ["method", "path", "app_name"],
+        buckets=exponential_bounds(*CLASSIC_EXPONENTS),
+    )
+else:
+    REQUESTS_PROCESSING_TIME = Histogram(
+        "fastapi_requests_duration_seconds",
+        "Histogram of requests processing time by path (in seconds)",
+        ["method", "path", "app_name"],
+    )
 EXCEPTIONS = Counter(
     "fastapi_exceptions_total",
     "Total count of exceptions raised by path and exception type",
@@ -46,93 +90,267 @@ REQUESTS_IN_PROGRESS = Gauge(
     "fastapi_requests_in_progress",
     "Gauge of requests by method and path currently being processed",
     ["method", "path", "app_name"],
+    multiprocess_mode=IN_PROGRESS_MULTIPROCESS_MODE,
 )
 
+# NOTE: per-route latency quantiles served by latency_stats, merged across
+# workers through the multiprocess directory
+LATENCY_SKETCHES = (
+    LatencySketches(
+        relative_accuracy=float(
+            os.environ.get("LATENCY_SKETCH_RELATIVE_ACCURACY", 0.01)
+        ),
+        path=MULTIPROC_DIR or None,
+    )
+    if os.environ.get("LATENCY_SKETCH_ENABLE", "true") == "true"
+    else None
+)
+
+
+class RouteMetrics:
+    """Metric children bound once per (method, path, app_name)
 
-class PrometheusMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app: ASGIApp, app_name: str = "fastapi-app") -> None:
-        super().__init__(app)
+    Avoids building label tuples and taking the family lock on every request.
+    Responses and exceptions are bound lazily per status code / exception type.
+    """
+
+    __slots__ = (
+        "method",
+        "path",
+        "app_name",
+        "requests",
+        "requests_in_progress",
+        "requests_processing_time",
+        "latency_sketch",
+        "otlp",
+        "guard",
+        "_responses",
+        "_exceptions",
+    )
+
+    def __init__(
+        self,
+        method: str,
+        path: str,
+        app_name: str,
+        guard: CardinalityGuard = NO_GUARD,
+        sketches: Optional[LatencySketches] = None,
+        otlp_metrics: Optional[OTLPMetrics] = None,
+    ) -> None:
+        self.method = method
+        self.path = path
         self.app_name = app_name
+        self.guard = guard
+        self.requests = guard.labels(
+            REQUESTS, method=method, path=path, app_name=app_name
+        )
+        self.requests_in_progress = guard.labels(
+            REQUESTS_IN_PROGRESS, method=method, path=path, app_name=app_name
+        )
+        self.requests_processing_time = guard.labels(
+            REQUESTS_PROCESSING_TIME, method=method, path=path, app_name=app_name
+        )
+        self.latency_sketch = sketches.route(method, path) if sketches else None
+        self.otlp = (
+            otlp_metrics.route(method, path, app_name) if otlp_metrics else None
+        )
+        self._responses: Dict[int, Counter] = {}
+        self._exceptions: Dict[str, Counter] = {}
+
+    def responses(self, status_code: int) -> Counter:
+        child = self._responses.get(status_code)
+        if child is None:
+            child = self._responses[status_code] = self.guard.labels(
+                RESPONSES,
+                method=self.method,
+                path=self.path,
+                status_code=status_code,
+                app_name=self.app_name,
+            )
+        return child
+
+    def exceptions(self, exception_type: str) -> Counter:
+        child = self._exceptions.get(exception_type)
+        if child is None:
+            child = self._exceptions[exception_type] = self.guard.labels(
+                EXCEPTIONS,
+                method=self.method,
+                path=self.path,
+                exception_type=exception_type,
+                app_name=self.app_name,
+            )
+        return child
+
+
+class PrometheusMiddleware:
+    """Pure ASGI middleware collecting request metrics.
+
+    Status code is taken from ``http.response.start`` and the duration is
+    observed once the final ``http.response.body`` message is sent, so
+    streaming responses and background tasks are left untouched.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        app_name: str = "fastapi-app",
+        max_label_sets: int = 1000,
+        label_allowlists: Optional[Mapping[str, Collection[str]]] = None,
+        latency_sketches: Optional[LatencySketches] = LATENCY_SKETCHES,
+        otlp_metrics: Optional[OTLPMetrics] = None,
+    ) -> None:
+        self.app = app
+        self.app_name = app_name
+        self.latency_sketches = latency_sketches
+        # NOTE: also push the request metrics over OTLP, see setting_otlp_metrics
+        self.otlp_metrics = otlp_metrics
+        # NOTE: e.g. label_allowlists={"exception_type": ["ValueError", "HTTPException"]}
+        self.guard = CardinalityGuard(max_label_sets, label_allowlists)
+        self.resolver = RouteResolver()
+        self.route_metrics: Dict[Tuple[str, str], RouteMetrics] = {}
         INFO.labels(app_name=self.app_name).inc()
 
-    async def dispatch(
-        self, request: Request, call_next: RequestResponseEndpoint
-    ) -> Response:
-        method = request.method
-        path, is_handled_path = self.get_path(request)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        path, is_handled_path = self.resolver.resolve(scope)
 
         if not is_handled_path:
-            return await call_next(request)
+            await self.app(scope, receive, send)
+            return
 
-        REQUESTS_IN_PROGRESS.labels(
-            method=method, path=path, app_name=self.app_name
-        ).inc()
-        REQUESTS.labels(method=method, path=path, app_name=self.app_name).inc()
+        route_metrics = self.get_route_metrics(method, path)
+        route_metrics.requests_in_progress.inc()
+        route_metrics.requests.inc()
+        otlp = route_metrics.otlp
+        if otlp is not None:
+            otlp.started()
         before_time = time.perf_counter()
+        status_code = HTTP_500_INTERNAL_SERVER_ERROR
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                after_time = time.perf_counter()
+                # retrieve trace id for exemplar
+                span = trace.get_current_span()
+                trace_id = trace.format_trace_id(span.get_span_context().trace_id)
+
+                route_metrics.requests_processing_time.observe(
+                    after_time - before_time, exemplar={"TraceID": trace_id}
+                )
+                if route_metrics.latency_sketch is not None:
+                    route_metrics.latency_sketch.add(after_time - before_time)
+                if otlp is not None:
+                    otlp.observe(after_time - before_time)
+            await send(message)
+
         try:
-            response = await call_next(request)
+            await self.app(scope, receive, send_wrapper)
         except BaseException as e:
             status_code = HTTP_500_INTERNAL_SERVER_ERROR
-            EXCEPTIONS.labels(
-                method=method,
-                path=path,
-                exception_type=type(e).__name__,
-                app_name=self.app_name,
-            ).inc()
+            route_metrics.exceptions(type(e).__name__).inc()
+            if otlp is not None:
+                otlp.exception(type(e).__name__)
             raise e from None
-        else:
-            status_code = response.status_code
-            after_time = time.perf_counter()
-            # retrieve trace id for exemplar
-            span = trace.get_current_span()
-            trace_id = trace.format_trace_id(span.get_span_context().trace_id)
-
-            REQUESTS_PROCESSING_TIME.labels(
-                method=method, path=path, app_name=self.app_name
-            ).observe(after_time - before_time, exemplar={"TraceID": trace_id})
         finally:
-            RESPONSES.labels(
-                method=method,
-                path=path,
-                status_code=status_code,
-                app_name=self.app_name,
-            ).inc()
-            REQUESTS_IN_PROGRESS.labels(
-                method=method, path=path, app_name=self.app_name
-            ).dec()
+            route_metrics.responses(status_code).inc()
+            route_metrics.requests_in_progress.dec()
+            if otlp is not None:
+                otlp.finished(status_code)
+
+    def get_route_metrics(self, method: str, path: str) -> RouteMetrics:
+        route_metrics = self.route_metrics.get((method, path))
+        if route_metrics is None:
+            route_metrics = self.route_metrics[(method, path)] = RouteMetrics(
+                method,
+                path,
+                self.app_name,
+                self.guard,
+                self.latency_sketches,
+                self.otlp_metrics,
+            )
+        return route_metrics
 
-        return response
+    def get_path(self, request: Request) -> Tuple[str, bool]:
+        return self.resolver.resolve(request.scope)
 
-    @staticmethod
-    def get_path(request: Request) -> Tuple[str, bool]:
-        for route in request.app.routes:
-            match, child_scope = route.matches(request.scope)
-            if match == Match.FULL:
-                return route.path, True
 
-        return request.url.path, False
+# NOTE: with several workers each one only knows its own counters
+EXPOSITION_CACHE = ExpositionCache(
+    collect_multiprocess if is_multiprocess_mode() else REGISTRY.collect,
+    max_age=float(os.environ.get("PROMETHEUS_EXPOSITION_MAX_AGE", 1.0)),
+)
 
 
 def metrics(request: Request) -> Response:
-    return Response(
-        generate_latest(REGISTRY), headers={"Content-Type": CONTENT_TYPE_LATEST}
-    )
+    # NOTE: sync endpoint, Starlette runs it in the threadpool off the event loop
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+    fmt = negotiate_format(request.headers.get("accept", ""))
+    headers = {
+        "Content-Type": CONTENT_TYPE_PROTOBUF if fmt == PROTOBUF else CONTENT_TYPE_LATEST,
+        "Vary": "Accept, Accept-Encoding",
+    }
+    if encoding != IDENTITY:
+        headers["Content-Encoding"] = encoding
+    return Response(EXPOSITION_CACHE.get(encoding, fmt), headers=headers)
+
+
+def latency_stats(request: Request) -> Response:
+    # NOTE: sync endpoint, the other workers' sketch files are read in the threadpool
+    if LATENCY_SKETCHES is None:
+        return JSONResponse({"detail": "Latency sketches are disabled"}, status_code=404)
+    return JSONResponse(LATENCY_SKETCHES.stats())
 
 
 def setting_otlp(
-    app: ASGIApp, app_name: str, endpoint: str, log_correlation: bool = True
+    app: ASGIApp,
+    app_name: str,
+    endpoint: str,
+    log_correlation: bool = True,
+    sampler: Optional[Sampler] = None,
+    max_queue_size: Optional[int] = None,
+    max_export_batch_size: Optional[int] = None,
+    schedule_delay_millis: Optional[float] = None,
+    export_timeout_millis: Optional[float] = None,
 ) -> None:
+    # NOTE: imported here, the exporter and instrumentations (grpc,
+    # pkg_resources) are slow to import and only needed with tracing
+    from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import (
+        OTLPSpanExporter,
+    )
+    from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+    from opentelemetry.instrumentation.logging import LoggingInstrumentor
+
+    from fastapi_app.core.span_export import InstrumentedBatchSpanProcessor
+
     # Setting OpenTelemetry
     # set the service name to show in traces
     resource = Resource.create(
         attributes={"service.name": app_name, "compose_service": app_name}
     )
 
-    # set the tracer provider
-    tracer = TracerProvider(resource=resource)
+    # set the tracer provider, see build_sampler for the sampling policy
+    tracer = TracerProvider(resource=resource, sampler=sampler)
     trace.set_tracer_provider(tracer)
 
-    tracer.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+    # NOTE: None sizes fall back to the OTEL_BSP_* env vars / SDK defaults
+    tracer.add_span_processor(
+        InstrumentedBatchSpanProcessor(
+            OTLPSpanExporter(endpoint=endpoint),
+            max_queue_size=max_queue_size,
+            schedule_delay_millis=schedule_delay_millis,
+            max_export_batch_size=max_export_batch_size,
+            export_timeout_millis=export_timeout_millis,
+        )
+    )
 
     if log_correlation:
         LoggingInstrumentor().instrument(set_logging_format=True)
@@ -140,6 +358,79 @@ def setting_otlp(
     FastAPIInstrumentor.instrument_app(app, tracer_provider=tracer)
 
 
+def setting_otlp_metrics(
+    app: ASGIApp,
+    app_name: str,
+    endpoint: str,
+    export_interval_millis: Optional[float] = None,
+    export_timeout_millis: Optional[float] = None,
+    max_export_batch_size: Optional[int] = None,
+) -> OTLPMetrics:
+    """Push the request metrics to the OTLP endpoint instead of waiting for a scrape
+
+    Counters and the histogram use delta temporality, the in-progress
+    up-down counter stays cumulative. The reader exports every
+    ``export_interval_millis`` (None falls back to OTEL_METRIC_EXPORT_INTERVAL,
+    60s) in batches of ``max_export_batch_size`` data points, and once more
+    at app shutdown so short-lived workers lose nothing.
+    """
+    # NOTE: imported here like in setting_otlp, only needed when enabled
+    from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import (
+        OTLPMetricExporter,
+    )
+    from opentelemetry.sdk.metrics import (
+        Counter as OTelCounter,
+        Histogram as OTelHistogram,
+        MeterProvider,
+        UpDownCounter as OTelUpDownCounter,
+    )
+    from opentelemetry.sdk.metrics.export import (
+        AggregationTemporality,
+        PeriodicExportingMetricReader,
+    )
+    from opentelemetry.sdk.metrics.view import (
+        ExplicitBucketHistogramAggregation,
+        ExponentialBucketHistogramAggregation,
+        View,
+    )
+
+    resource = Resource.create(
+        attributes={"service.name": app_name, "compose_service": app_name}
+    )
+    exporter = OTLPMetricExporter(
+        endpoint=endpoint,
+        preferred_temporality={
+            OTelCounter: AggregationTemporality.DELTA,
+            OTelHistogram: AggregationTemporality.DELTA,
+            OTelUpDownCounter: AggregationTemporality.CUMULATIVE,
+        },
+        max_export_batch_size=max_export_batch_size,
+    )
+    reader = PeriodicExportingMetricReader(
+        exporter,
+        export_interval_millis=export_interval_millis,
+        export_timeout_millis=export_timeout_millis,
+    )
+    # NOTE: same buckets as the Prometheus histogram (the SDK defaults are in ms)
+    aggregation = (
+        ExponentialBucketHistogramAggregation()
+        if EXPONENTIAL_HISTOGRAM
+        else ExplicitBucketHistogramAggregation(list(Histogram.DEFAULT_BUCKETS[:-1]))
+    )
+    provider = MeterProvider(
+        metric_readers=[reader],
+        resource=resource,
+        views=[View(instrument_type=OTelHistogram, aggregation=aggregation)],
+        shutdown_on_exit=False,
+    )
+    otlp_metrics = OTLPMetrics(provider.get_meter("fastapi_app"), provider)
+
+    # NOTE: at app shutdown, or at exit when the lifespan never ran
+    app.add_event_handler("shutdown", otlp_metrics.shutdown)
+    atexit.register(otlp_metrics.shutdown)
+    return otlp_metrics
+
+
 def is_running_in_docker():
     # with open("/proc/1/cgroup", "r") as f:
     #     for line in f: